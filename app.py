@@ -1,16 +1,273 @@
-from flask import Flask, render_template, redirect, request, url_for, flash
+from flask import Flask, Response, abort, render_template, send_from_directory, redirect, request, url_for, flash, jsonify, session, stream_with_context, g, has_request_context, before_render_template, template_rendered, stream_template
+from markupsafe import Markup
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event, tuple_
+from sqlalchemy.exc import IntegrityError, OperationalError
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session, selectinload, with_loader_criteria
 from flask_login import LoginManager, UserMixin, login_user, logout_user, login_required, current_user
+from werkzeug.http import is_resource_modified, parse_cookie
 from werkzeug.security import generate_password_hash, check_password_hash
-from datetime import datetime, timedelta
-import pytz
+from datetime import datetime, timedelta, timezone
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import wraps
+from urllib.parse import parse_qs, urlsplit
+import asyncio
+import atexit
+import click
+import csv
+import hashlib
+import io
+import itertools
+import json
+import mmap
+import os
+import random
+import re
+import struct
+import threading
+import time
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'abc#203$@sir'  # Replace with a strong random key
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///database.db'  # Database filename
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///database.db')  # Database filename, or a server database URL
+app.config['DB_PROFILE'] = os.environ.get('DB_PROFILE', 'production')  # Key of DB_PROFILES below
+app.config['VISITOR_COUNTER'] = 'batched'  # 'batched' (in-process, flushed on a timer) or 'sqlite' (atomic write per hit)
+app.config['VISITOR_COUNTER_FLUSH_INTERVAL'] = 5  # Seconds between flushes of the batched counter
+app.config['PAGE_SIZE'] = 50  # Default rows per page on admin listings and donations
+app.config['MAX_PAGE_SIZE'] = 500  # Upper bound for the ?per_page= parameter
+app.config['LEADERBOARD_SIZE'] = 10  # Top donors shown on /view_donations
+app.config['USER_CACHE_SIZE'] = 1024  # Logged-in identities kept by the user_loader cache (LRU)
+app.config['USER_CACHE_TTL'] = 30  # Seconds a cached identity is kept; edits are seen at once through the user's generation
+app.config['USER_CACHE_COLUMNS'] = ('id', 'username', 'fname')  # Columns loaded per request; None loads the full row
+app.config['USER_GENERATIONS_FILE'] = os.environ.get('USER_GENERATIONS_FILE', os.path.join(app.instance_path, 'user_generations'))  # Memory-mapped by every worker; bumped when a user changes
+app.config['USER_GENERATIONS_SLOTS'] = 65536  # Users share a slot when their ids are equal modulo this; a shared slot only costs extra misses
+app.config['PASSWORD_HASH_METHOD'] = 'scrypt:32768:8:1'  # werkzeug method string, e.g. 'pbkdf2:sha256:600000'; older hashes are upgraded on login
+app.config['PASSWORD_HASH_POOL'] = 'thread'  # 'thread', 'process' or None to hash on the request thread
+app.config['PASSWORD_HASH_WORKERS'] = 2  # Hashes computed at the same time per gunicorn worker
+app.config['PASSWORD_HASH_QUEUE_LIMIT'] = 16  # Hashes allowed to wait; beyond this the request gets a 503
+app.config['BULK_IMPORT_BATCH_SIZE'] = 1000  # Rows inserted per executemany/commit during bulk import
+app.config['BULK_IMPORT_HASH_METHOD'] = 'pbkdf2:sha256:1000'  # Cheap method for imported passwords; upgraded on first login
+app.config['BULK_IMPORT_HASH_WORKERS'] = 1  # Import hashes run on their own pool so logins never queue behind them
+app.config['ROSTER_POLL_INTERVAL'] = 0.5  # Seconds between polls of roster_event by each worker's feed thread
+app.config['ROSTER_HEARTBEAT'] = 15  # Seconds between keep-alive comments on idle event streams
+app.config['ROSTER_BUFFER_SIZE'] = 1000  # Recent events kept in memory per worker for fan-out and Last-Event-ID resume
+app.config['ROSTER_EVENT_RETENTION'] = 3600  # Seconds roster events are kept in the database
+app.config['ROSTER_MAX_STREAMS'] = int(os.environ.get('ROSTER_MAX_STREAMS', 4))  # Streams served by the Flask route per worker (each holds a request thread); production uses serve-events
+app.config['EVENTS_SOCKET'] = os.environ.get('EVENTS_SOCKET', os.path.join(app.instance_path, 'events.sock'))  # Unix socket `flask --app app serve-events` listens on
+app.config['EVENTS_MAX_STREAMS'] = int(os.environ.get('EVENTS_MAX_STREAMS', 10000))  # Streams held by the event server; each is an idle socket, not a thread
+app.config['DISPLAY_TIMEZONE'] = 'Asia/Kolkata'  # Timezone of the dashboard clock and displayed timestamps
+app.config['INSTRUMENTATION'] = os.environ.get('INSTRUMENTATION') == '1'  # Per-request timing and SQL stats, served at /metrics
+app.config['INSTRUMENTATION_HEADER'] = False  # Also add an X-Request-Stats header to every response
+app.config['N_PLUS_ONE_THRESHOLD'] = 10  # Same statement shape this many times in one request is flagged as N+1
+app.config['PROFILER_SAMPLE_RATE'] = 0.0  # Fraction of requests run under cProfile (0 turns the sampler off)
+app.config['PROFILER_KEEP'] = 10  # Slowest sampled endpoints whose profiles are kept for /admin/profiles
+app.config['RATE_LIMITS'] = {  # Endpoint -> (requests, per seconds, 'ip' or 'user'); bursts up to `requests` are allowed
+    'login': (10, 60, 'ip'),
+    'register': (5, 300, 'ip'),
+    'donate': (10, 60, 'ip'),
+    'change_password': (5, 60, 'user'),
+}
+app.config['RATE_LIMIT_METHODS'] = ('POST',)  # Only these methods are counted; page views (GET) are never throttled
+app.config['RATE_LIMIT_STORAGE'] = os.environ.get('RATE_LIMIT_STORAGE', 'memory')  # 'memory' (per worker) or a SQLite file shared by all workers, e.g. /dev/shm/ratelimit.db
+app.config['RATE_LIMIT_MAX_KEYS'] = 100000  # Buckets kept by the in-memory store before idle ones are dropped
+app.config['JOB_WORKERS'] = int(os.environ.get('JOB_WORKERS', 2))  # Job threads per process (gunicorn worker or `flask run-jobs`)
+app.config['JOB_POLL_INTERVAL'] = 0.5  # Seconds an idle job thread waits before looking for due jobs again
+app.config['JOB_MAX_ATTEMPTS'] = 5  # Default tries per job; retries back off 2, 4, 8... seconds
+app.config['JOB_LEASE'] = 600  # Seconds after which a running job whose process died is queued again
+app.config['JOB_RETENTION'] = 7 * 24 * 3600  # Seconds finished jobs are kept
+app.config['SOFT_DELETE_RETENTION_DAYS'] = 30  # Deleted games and teams are purged for good after this many days
+app.config['IMAGE_DIR'] = os.path.join(app.instance_path, 'images')  # Uploaded game images and their thumbnails
+app.config['IMAGE_WIDTHS'] = (400, 800)  # Thumbnail widths (1x and 2x of a game card); thumbnails are cropped to 2:1
+app.config['IMAGE_MAX_BYTES'] = 10 * 1024 * 1024  # Largest upload or downloaded source image
+app.config['IMAGE_CACHE_MAX_AGE'] = 365 * 24 * 3600  # Browser cache lifetime of /images/ files (names change with content)
+
+# Hosting providers hand out postgres:// URLs, which SQLAlchemy no longer accepts
+if app.config['SQLALCHEMY_DATABASE_URI'].startswith('postgres://'):
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'postgresql://' + app.config['SQLALCHEMY_DATABASE_URI'][len('postgres://'):]
+
+# Storage profiles: connection pool sizing, SQLite pragmas set on every connection, and busy retries
+DB_PROFILES = {
+    'basic': {
+        'engine_options': {},
+        'sqlite_pragmas': {'foreign_keys': 'ON'},
+        'busy_retries': 0,
+    },
+    'production': {
+        'engine_options': {'pool_size': 10, 'max_overflow': 20, 'pool_timeout': 10, 'pool_pre_ping': True},
+        'sqlite_pragmas': {
+            'journal_mode': 'WAL',  # readers no longer block behind writers
+            'synchronous': 'NORMAL',  # safe with WAL, one fsync per checkpoint instead of per commit
+            'cache_size': -20000,  # ~20 MB page cache per connection
+            'mmap_size': 268435456,  # read the database through a 256 MB memory map
+            'temp_store': 'MEMORY',
+            'busy_timeout': 5000,  # wait up to 5 s for a write lock instead of failing at once
+            'foreign_keys': 'ON',  # enforce foreign keys and their ON DELETE CASCADE
+        },
+        'busy_retries': 5,
+    },
+}
+db_profile = DB_PROFILES[app.config['DB_PROFILE']]
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = db_profile['engine_options']
+app.config['DB_BUSY_RETRIES'] = db_profile['busy_retries']  # Times a write view is re-run after "database is locked"
+app.config['DB_BUSY_RETRY_DELAY'] = 0.05  # First backoff in seconds, doubled on each retry
 
 db = SQLAlchemy(app)
 
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    for name, value in db_profile['sqlite_pragmas'].items():
+        cursor.execute("PRAGMA {} = {}".format(name, value))
+    cursor.close()
+
+with app.app_context():
+    if db.engine.dialect.name == 'sqlite':
+        event.listen(db.engine, 'connect', set_sqlite_pragmas)
+
+# Request instrumentation: wall, template and SQL time per request, aggregated per endpoint
+class RequestMetrics:
+    FIELDS = ('requests', 'wall_seconds', 'template_seconds', 'sql_statements', 'sql_seconds', 'n_plus_one')
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.endpoints = {}
+        self.max_wall = {}
+        self.profiles = {}  # endpoint -> (wall seconds, profile text) of its slowest sampled request
+        self.profiler_lock = threading.Lock()
+
+    def record(self, endpoint, stats):
+        with self.lock:
+            totals = self.endpoints.setdefault(endpoint, dict((field, 0) for field in self.FIELDS))
+            totals['requests'] += 1
+            for field in self.FIELDS[1:]:
+                totals[field] += stats[field]
+            self.max_wall[endpoint] = max(self.max_wall.get(endpoint, 0), stats['wall_seconds'])
+
+    def keep_profile(self, endpoint, wall, profile):
+        with self.lock:
+            if endpoint in self.profiles and self.profiles[endpoint][0] >= wall:
+                return
+            import pstats
+            output = io.StringIO()
+            pstats.Stats(profile, stream=output).sort_stats('cumulative').print_stats(40)
+            self.profiles[endpoint] = (wall, output.getvalue())
+            # Only the slowest PROFILER_KEEP endpoints are kept
+            slowest = sorted(self.profiles.items(), key=lambda item: item[1][0], reverse=True)
+            self.profiles = dict(slowest[:app.config['PROFILER_KEEP']])
+
+    def prometheus(self):
+        lines = []
+        with self.lock:
+            for field in self.FIELDS:
+                name = 'gms_{}_total'.format(field)
+                lines.append('# TYPE {} counter'.format(name))
+                for endpoint, totals in sorted(self.endpoints.items()):
+                    lines.append('{}{{endpoint="{}"}} {}'.format(name, endpoint, totals[field]))
+            lines.append('# TYPE gms_wall_seconds_max gauge')
+            for endpoint, value in sorted(self.max_wall.items()):
+                lines.append('gms_wall_seconds_max{{endpoint="{}"}} {}'.format(endpoint, value))
+        return '\n'.join(lines) + '\n'
+
+request_metrics = RequestMetrics()
+SQL_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+\b")
+SQL_PARAM_LISTS = re.compile(r"\((?:\s*\?\s*,)+\s*\?\s*\)")
+
+# Helper function to reduce a statement to its shape, so repeats with different ids/IN-lists match
+def statement_shape(statement):
+    return SQL_PARAM_LISTS.sub('(?)', SQL_LITERALS.sub('?', statement))
+
+def instrumentation_stats():
+    if not has_request_context() or 'request_stats' not in g:
+        return None
+    return g.request_stats
+
+def start_request_stats():
+    g.request_stats = {'start': time.perf_counter(), 'wall_seconds': 0, 'template_seconds': 0,
+                       'sql_statements': 0, 'sql_seconds': 0, 'n_plus_one': 0, 'shapes': {}}
+    if app.config['PROFILER_SAMPLE_RATE'] and random.random() < app.config['PROFILER_SAMPLE_RATE']:
+        # cProfile cannot profile two threads at once, so overlapping samples are skipped
+        if request_metrics.profiler_lock.acquire(blocking=False):
+            import cProfile
+            g.profiler = cProfile.Profile()
+            g.profiler.enable()
+
+def finish_request_stats(response):
+    stats = instrumentation_stats()
+    if stats is None:
+        return response
+    stats['wall_seconds'] = time.perf_counter() - stats['start']
+    endpoint = request.endpoint or 'unknown'
+    for shape, count in stats['shapes'].items():
+        if count >= app.config['N_PLUS_ONE_THRESHOLD']:
+            stats['n_plus_one'] += 1
+            app.logger.warning("Possible N+1 in %s: %d x %s", endpoint, count, shape[:200])
+    request_metrics.record(endpoint, stats)
+
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        profiler.disable()
+        request_metrics.profiler_lock.release()
+        request_metrics.keep_profile(endpoint, stats['wall_seconds'], profiler)
+
+    if app.config['INSTRUMENTATION_HEADER']:
+        response.headers['X-Request-Stats'] = 'wall={:.1f}ms;template={:.1f}ms;sql={};sql_time={:.1f}ms;n_plus_one={}'.format(
+            stats['wall_seconds'] * 1000, stats['template_seconds'] * 1000,
+            stats['sql_statements'], stats['sql_seconds'] * 1000, stats['n_plus_one'])
+    return response
+
+def before_sql(conn, cursor, statement, parameters, context, executemany):
+    if instrumentation_stats() is not None:
+        context._instrumentation_start = time.perf_counter()
+
+def after_sql(conn, cursor, statement, parameters, context, executemany):
+    stats = instrumentation_stats()
+    if stats is None or not hasattr(context, '_instrumentation_start'):
+        return
+    stats['sql_statements'] += 1
+    stats['sql_seconds'] += time.perf_counter() - context._instrumentation_start
+    shape = statement_shape(statement)
+    stats['shapes'][shape] = stats['shapes'].get(shape, 0) + 1
+
+def before_template(sender, template, context, **extra):
+    stats = instrumentation_stats()
+    if stats is not None:
+        stats.setdefault('template_starts', []).append(time.perf_counter())
+
+def after_template(sender, template, context, **extra):
+    stats = instrumentation_stats()
+    if stats is not None and stats.get('template_starts'):
+        stats['template_seconds'] += time.perf_counter() - stats['template_starts'].pop()
+
+if app.config['INSTRUMENTATION']:
+    app.before_request(start_request_stats)
+    app.after_request(finish_request_stats)
+    with app.app_context():
+        event.listen(db.engine, 'before_cursor_execute', before_sql)
+        event.listen(db.engine, 'after_cursor_execute', after_sql)
+    before_render_template.connect(before_template, app)
+    template_rendered.connect(after_template, app)
+
+# Helper function to tell SQLITE_BUSY/"database is locked" apart from other operational errors
+def is_database_busy(error):
+    message = str(error.orig).lower()
+    return 'database is locked' in message or 'database is busy' in message
+
+# Re-run a write view with exponential backoff when SQLite reports the database as busy
+def retry_on_busy(view):
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        retries = app.config['DB_BUSY_RETRIES']
+        for attempt in range(retries + 1):
+            try:
+                return view(*args, **kwargs)
+            except OperationalError as error:
+                if attempt == retries or not is_database_busy(error):
+                    raise
+                db.session.rollback()
+                time.sleep(app.config['DB_BUSY_RETRY_DELAY'] * (2 ** attempt) * (1 + random.random()))
+    return wrapper
+
 login_manager = LoginManager(app)
 login_manager.login_view = 'login'
 
@@ -19,13 +276,44 @@ class Donationsnew(db.Model):
     donor_name = db.Column(db.String(100), nullable=False)
     donor_type = db.Column(db.String(100), nullable=False)
     amount = db.Column(db.Float, nullable=False)
-    donation_date = db.Column(db.DateTime, default=datetime.now(pytz.timezone('Asia/Kolkata')))
+    # Stored in UTC and shown in DISPLAY_TIMEZONE via the |local_time filter. Set in Python on each insert, so
+    # SQLite stores it with microseconds, the same text format the keyset pagination cursor is bound in.
+    donation_date = db.Column(db.DateTime, default=datetime.utcnow)
+
+    # Back the keyset pagination on /view_donations (sort by amount or date, filter by donor type)
+    __table_args__ = (
+        db.Index('ix_donationsnew_amount_id', 'amount', 'id'),
+        db.Index('ix_donationsnew_date_id', 'donation_date', 'id'),
+        db.Index('ix_donationsnew_type_amount_id', 'donor_type', 'amount', 'id'),
+    )
+
+# Donations of finished seasons, moved here by end_of_season()
+class DonationArchive(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    season = db.Column(db.String(50), nullable=False, index=True)
+    donor_name = db.Column(db.String(100), nullable=False)
+    donor_type = db.Column(db.String(100), nullable=False)
+    amount = db.Column(db.Float, nullable=False)
+    donation_date = db.Column(db.DateTime)
+    archived_at = db.Column(db.DateTime, nullable=False)
 
 class UserDonation(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), nullable=False)
     total_donated = db.Column(db.Float, default=0.0, nullable=False)
 
+# Running donation totals per donor type, updated in the same transaction as each donation
+class DonationTotal(db.Model):
+    donor_type = db.Column(db.String(100), primary_key=True)
+    total = db.Column(db.Float, default=0.0, nullable=False)
+    donation_count = db.Column(db.Integer, default=0, nullable=False)
+
+# Running donation totals per donor, read by the leaderboard through the total index
+class DonorTotal(db.Model):
+    donor_name = db.Column(db.String(100), primary_key=True)
+    donor_type = db.Column(db.String(100), nullable=False)
+    total = db.Column(db.Float, default=0.0, nullable=False, index=True)
+
 
 # User model
 class User(UserMixin, db.Model):
@@ -44,84 +332,858 @@ class User(UserMixin, db.Model):
     def __repr__(self):
         return "<User {}>".format(self.username)
 
+    # The ORM row itself, so views can use current_user.record whether or not it came from the cache
+    @property
+    def record(self):
+        return self
+
+# Soft delete: rows with deleted_at set stay in the table (until purge_deleted()) but are left out of every
+# ORM select by the exclude_soft_deleted hook below
+class SoftDelete:
+    deleted_at = db.Column(db.DateTime)
+
 # Game model
-class Game(db.Model):
+class Game(SoftDelete, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     game_image = db.Column(db.String(200), nullable=False)
+    image_key = db.Column(db.String(64))  # Content hash naming the thumbnails of game_image, set once they exist
     game_name = db.Column(db.String(100), nullable=False)
     game_details = db.Column(db.Text, nullable=False)
     team_size = db.Column(db.Integer, nullable=False)  
-
-class Team(db.Model):
+    # Partial indexes: name lookups only ever see live games, purges only deleted ones
+    __table_args__ = (
+        db.Index('ix_game_game_name_live', 'game_name',
+                 sqlite_where=db.text('deleted_at IS NULL'), postgresql_where=db.text('deleted_at IS NULL')),
+        db.Index('ix_game_deleted_at', 'deleted_at',
+                 sqlite_where=db.text('deleted_at IS NOT NULL'), postgresql_where=db.text('deleted_at IS NOT NULL')),
+    )
+
+class Team(SoftDelete, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
-    game_id = db.Column(db.Integer, db.ForeignKey('game.id'))
+    game_id = db.Column(db.Integer, db.ForeignKey('game.id', ondelete='CASCADE'), index=True)
+    # Kept in step with user_team by add_team_member/remove_team_member, so capacity checks never load members
+    member_count = db.Column(db.Integer, default=0, server_default='0', nullable=False)
+    season = db.Column(db.String(50))  # Set (with deleted_at) when end_of_season() archives the team
     game = db.relationship('Game', backref='teams')
     members = db.relationship('User', secondary='user_team', backref='teams')
+    __table_args__ = (
+        db.Index('ix_team_deleted_at', 'deleted_at',
+                 sqlite_where=db.text('deleted_at IS NOT NULL'), postgresql_where=db.text('deleted_at IS NOT NULL')),
+    )
+
+@event.listens_for(Session, 'do_orm_execute')
+def exclude_soft_deleted(state):
+    if (state.is_select and not state.is_column_load and not state.is_relationship_load
+            and not state.execution_options.get('include_deleted', False)):
+        state.statement = state.statement.options(
+            with_loader_criteria(SoftDelete, lambda cls: cls.deleted_at.is_(None), include_aliases=True)
+        )
 
 # Intermediate table for many-to-many relationship between User and Team
 user_team = db.Table(
     'user_team',
-    db.Column('user_id', db.Integer, db.ForeignKey('user.id')),
-    db.Column('team_id', db.Integer, db.ForeignKey('team.id'))
+    db.Column('user_id', db.Integer, db.ForeignKey('user.id', ondelete='CASCADE')),
+    db.Column('team_id', db.Integer, db.ForeignKey('team.id', ondelete='CASCADE')),
+    db.Index('uq_user_team_user_id_team_id', 'user_id', 'team_id', unique=True),
+    db.Index('ix_user_team_team_id', 'team_id'),
 )
 
-@login_manager.user_loader
-def load_user(user_id):
-    return User.query.get(int(user_id))
+# A user's sign-up for a game; signed-up users without a team in that game are placed by matchmake()
+class GameSignup(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    game_id = db.Column(db.Integer, db.ForeignKey('game.id', ondelete='CASCADE'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), nullable=False, index=True)
+    created_at = db.Column(db.DateTime, default=db.func.now(), server_default=db.func.now(), nullable=False)
+    __table_args__ = (
+        db.Index('uq_game_signup_game_id_user_id', 'game_id', 'user_id', unique=True),
+    )
+
+# Roster changes (joined, left, removed, team_created, team_deleted, matchmade) written in the same transaction as
+# the change itself; every worker polls this table and pushes new rows to its /events/rosters streams
+class RosterEvent(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(20), nullable=False)
+    game_id = db.Column(db.Integer)
+    team_id = db.Column(db.Integer, nullable=False)
+    team_name = db.Column(db.String(100))
+    user_id = db.Column(db.Integer)
+    user_name = db.Column(db.String(255))
+    created_at = db.Column(db.DateTime, default=db.func.now(), server_default=db.func.now(), nullable=False, index=True)
+
+def publish_roster_event(kind, team_id, game_id, team_name=None, user_id=None, user_name=None):
+    db.session.add(RosterEvent(kind=kind, team_id=team_id, game_id=game_id, team_name=team_name, user_id=user_id, user_name=user_name))
+
+# Add a member with one conditional write: the count only goes up while the team is below its game's
+# team_size, and the unique (user_id, team_id) index rejects duplicates. Returns 'joined', 'full' or
+# 'member'; on anything but 'joined' the caller must roll back. The caller commits.
+def add_team_member(user_id, team_id, enforce_capacity=True):
+    query = db.update(Team).where(Team.id == team_id)
+    if enforce_capacity:
+        team_size = db.select(Game.team_size).where(Game.id == Team.game_id).scalar_subquery()
+        query = query.where(Team.member_count < team_size)
+    if not db.session.execute(query.values(member_count=Team.member_count + 1)).rowcount:
+        return 'full'
+    try:
+        with db.session.begin_nested():
+            db.session.execute(user_team.insert().values(user_id=user_id, team_id=team_id))
+    except IntegrityError:
+        return 'member'
+    return 'joined'
+
+# Remove a member without loading the team; returns False if the user was not in it. The caller commits.
+def remove_team_member(user_id, team_id):
+    removed = db.session.execute(
+        user_team.delete().where(user_team.c.user_id == user_id, user_team.c.team_id == team_id)
+    ).rowcount
+    if removed:
+        db.session.execute(db.update(Team).where(Team.id == team_id).values(member_count=Team.member_count - removed))
+    return bool(removed)
+
+# Recompute member_count from user_team for the given teams (after bulk changes)
+def recount_team_members(team_ids):
+    count = db.select(db.func.count()).select_from(user_team).where(user_team.c.team_id == Team.id).scalar_subquery()
+    db.session.execute(db.update(Team).where(Team.id.in_(list(team_ids))).values(member_count=count))
+
+# Background jobs: slow side effects are written to this table in the same transaction as the request's
+# own changes and run afterwards by JobWorker threads. Higher priority runs first. A dedupe_key makes
+# enqueue() a no-op while a job with the same key is still queued or running.
+class Job(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(50), nullable=False)
+    payload = db.Column(db.Text, nullable=False, default='{}')  # JSON keyword arguments of the handler
+    priority = db.Column(db.Integer, nullable=False, default=0)
+    status = db.Column(db.String(10), nullable=False, default='queued')  # queued, running, done or failed
+    dedupe_key = db.Column(db.String(100))
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False, default=1)
+    run_at = db.Column(db.DateTime, nullable=False)
+    locked_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+    result = db.Column(db.Text)  # JSON return value of the handler
+    last_error = db.Column(db.Text)
+    __table_args__ = (
+        db.Index('ix_job_status_priority_run_at', 'status', 'priority', 'run_at'),
+        db.Index('uq_job_dedupe_key', 'dedupe_key', unique=True,
+                 sqlite_where=db.text("status IN ('queued', 'running')"),
+                 postgresql_where=db.text("status IN ('queued', 'running')")),
+    )
+
+JOB_HANDLERS = {}
+
+# Register a function as the handler of the jobs with this name; it is called with the payload as keyword
+# arguments inside an app context, and its JSON-serializable return value is stored in Job.result
+def job_handler(name):
+    def register(func):
+        JOB_HANDLERS[name] = func
+        return func
+    return register
+
+# Queue a job in the current session; it runs once the caller commits. Returns False if deduplicated.
+def enqueue(name, priority=0, dedupe_key=None, max_attempts=None, delay=0, **payload):
+    values = {
+        'name': name, 'payload': json.dumps(payload), 'priority': priority, 'dedupe_key': dedupe_key,
+        'status': 'queued', 'attempts': 0,
+        'max_attempts': app.config['JOB_MAX_ATTEMPTS'] if max_attempts is None else max_attempts,
+        'run_at': datetime.utcnow() + timedelta(seconds=delay),
+    }
+    job_worker.start()
+    if dedupe_key is None:
+        db.session.execute(db.insert(Job).values(values))
+        return True
+    stmt = upsert(Job).values(values).on_conflict_do_nothing(
+        index_elements=['dedupe_key'], index_where=Job.status.in_(['queued', 'running'])
+    )
+    return bool(db.session.execute(stmt).rowcount)
+
+# Pool of threads that claim due jobs one at a time with a conditional UPDATE, so any number of
+# threads and processes can share the table without running a job twice
+class JobWorker:
+    def __init__(self, app):
+        self.app = app
+        self.lock = threading.Lock()
+        self.threads = []
+
+    def start(self, workers=None):
+        with self.lock:
+            if self.threads:
+                return
+            for i in range(self.app.config['JOB_WORKERS'] if workers is None else workers):
+                thread = threading.Thread(target=self.run, name='job-worker-{}'.format(i), daemon=True)
+                thread.start()
+                self.threads.append(thread)
+
+    def run(self):
+        passes = 0
+        while True:
+            try:
+                with self.app.app_context():
+                    if passes % 1200 == 0:
+                        self.housekeeping()
+                    passes += 1
+                    ran = self.run_one()
+                    db.session.remove()
+            except OperationalError:
+                # Busy or briefly unavailable database: try again after the poll interval
+                ran = False
+            if not ran:
+                time.sleep(self.app.config['JOB_POLL_INTERVAL'])
+
+    # Claim and run the most urgent due job; returns False when there was none. The due job is found
+    # with a plain SELECT first, so idle polls never open a write transaction.
+    def run_one(self):
+        now = datetime.utcnow()
+        due_id = db.session.execute(
+            db.select(Job.id).where(Job.status == 'queued', Job.run_at <= now)
+            .order_by(Job.priority.desc(), Job.run_at, Job.id).limit(1)
+        ).scalar()
+        if due_id is None:
+            db.session.rollback()
+            return False
+        claimed = db.session.execute(
+            db.update(Job).where(Job.id == due_id, Job.status == 'queued')
+            .values(status='running', locked_at=now, attempts=Job.attempts + 1)
+            .returning(Job.id, Job.name, Job.payload, Job.attempts, Job.max_attempts)
+        ).first()
+        db.session.commit()
+        if claimed is None:
+            # Another worker claimed it first; look again right away
+            return True
+
+        try:
+            result = JOB_HANDLERS[claimed.name](**json.loads(claimed.payload))
+        except Exception as error:
+            db.session.rollback()
+            self.app.logger.exception("Job %s (%s) failed", claimed.id, claimed.name)
+            values = {'last_error': '{}: {}'.format(type(error).__name__, error)[:2000]}
+            if claimed.attempts < claimed.max_attempts:
+                values.update(status='queued', run_at=datetime.utcnow() + timedelta(seconds=2 ** claimed.attempts))
+            else:
+                values.update(status='failed', finished_at=datetime.utcnow())
+        else:
+            values = {'status': 'done', 'finished_at': datetime.utcnow(),
+                      'result': None if result is None else json.dumps(result, default=str)}
+        # For handlers that do not commit themselves, their changes and the status land in one transaction
+        db.session.execute(db.update(Job).where(Job.id == claimed.id).values(values))
+        db.session.commit()
+        return True
+
+    # Requeue jobs left running by a process that died (or fail them once out of attempts),
+    # and drop old finished jobs
+    def housekeeping(self):
+        now = datetime.utcnow()
+        stale = db.and_(Job.status == 'running', Job.locked_at < now - timedelta(seconds=self.app.config['JOB_LEASE']))
+        db.session.execute(
+            db.update(Job).where(stale, Job.attempts >= Job.max_attempts)
+            .values(status='failed', finished_at=now, last_error='Lease expired on the last attempt')
+        )
+        db.session.execute(db.update(Job).where(stale).values(status='queued'))
+        db.session.execute(
+            db.delete(Job).where(Job.status.in_(['done', 'failed']),
+                                 Job.finished_at < now - timedelta(seconds=self.app.config['JOB_RETENTION']))
+        )
+        db.session.commit()
 
-@app.route('/')
-@login_required
-def dashboard():
-    # Helper function to read and update visitor count
-    def get_visitor_count():
-        with open("visitor_count.txt", "r") as f:
-            count = int(f.read())
-        count += 1
-        with open("visitor_count.txt", "w") as f:
-            f.write(str(count))
-        return count
-    
-    # Get the current UTC time
-    utc_now = datetime.utcnow()
+job_worker = JobWorker(app)
+
+# Named counters (e.g. visitor count) stored as one row each
+class Counter(db.Model):
+    name = db.Column(db.String(50), primary_key=True)
+    value = db.Column(db.Integer, default=0, nullable=False)
+    updated_at = db.Column(db.DateTime)  # Set when used as a change version (Last-Modified of the JSON API)
+
+# Helper function to read the legacy visitor_count.txt once, used to seed a missing counter row
+def legacy_counter_value(name):
+    if name != 'visitors' or not os.path.exists("visitor_count.txt"):
+        return 0
+    with open("visitor_count.txt", "r") as f:
+        return int(f.read() or 0)
+
+# Atomic SQLite-backed counter: one upsert per increment, safe across gunicorn workers
+class SQLiteCounter:
+    def __init__(self, app):
+        self.app = app
+        self.seeds = {}
+
+    def add(self, name, amount):
+        if name not in self.seeds:
+            self.seeds[name] = legacy_counter_value(name)
+        with self.app.app_context():
+            with db.engine.begin() as conn:
+                conn.execute(
+                    db.text(
+                        "INSERT INTO counter (name, value) VALUES (:name, :seed + :amount) "
+                        "ON CONFLICT(name) DO UPDATE SET value = value + :amount"
+                    ),
+                    {'name': name, 'seed': self.seeds[name], 'amount': amount}
+                )
+                return conn.execute(db.text("SELECT value FROM counter WHERE name = :name"), {'name': name}).scalar()
+
+    def increment(self, name):
+        return self.add(name, 1)
+
+    def read(self, name):
+        with self.app.app_context():
+            value = db.session.execute(db.select(Counter.value).where(Counter.name == name)).scalar()
+        return legacy_counter_value(name) if value is None else value
+
+# In-process batched counter: increments are collected in memory and flushed on a timer or at shutdown
+class BatchedCounter:
+    def __init__(self, app, interval):
+        self.store = SQLiteCounter(app)
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.totals = {}
+        self.timer = None
+
+    def increment(self, name):
+        # One read per worker so the first page views show the stored total instead of 0
+        if name not in self.totals:
+            total = self.store.read(name)
+            with self.lock:
+                self.totals.setdefault(name, total)
+        with self.lock:
+            self.pending[name] = self.pending.get(name, 0) + 1
+            if self.timer is None:
+                self.timer = threading.Timer(self.interval, self.flush)
+                self.timer.daemon = True
+                self.timer.start()
+            # Approximate value: last flushed total plus what this worker has not written yet
+            return self.totals.get(name, 0) + self.pending[name]
+
+    def flush(self):
+        with self.lock:
+            pending, self.pending = self.pending, {}
+            self.timer = None
+        for name, amount in pending.items():
+            total = self.store.add(name, amount)
+            with self.lock:
+                self.totals[name] = total
+
+def make_visitor_counter(app):
+    if app.config['VISITOR_COUNTER'] == 'sqlite':
+        return SQLiteCounter(app)
+    counter = BatchedCounter(app, app.config['VISITOR_COUNTER_FLUSH_INTERVAL'])
+    atexit.register(counter.flush)
+    return counter
+
+visitor_counter = make_visitor_counter(app)
+
+# Helper function for keyset (cursor) pagination: the page is located by the last row's
+# sort key and id instead of an OFFSET, so page N costs the same index seek as page 1
+def keyset_page(query, sort_column, id_column, descending=False):
+    per_page = request.args.get('per_page', app.config['PAGE_SIZE'], type=int)
+    per_page = max(1, min(per_page, app.config['MAX_PAGE_SIZE']))
+    key = tuple_(sort_column, id_column)
+
+    after = request.args.get('after')
+    if after:
+        value, _, last_id = after.rpartition('|')
+        try:
+            if sort_column.type.python_type is datetime:
+                value = datetime.fromisoformat(value)
+            else:
+                value = sort_column.type.python_type(value)
+            last = tuple_(value, int(last_id))
+        except ValueError:
+            # A hand-edited or truncated cursor
+            abort(400, "Invalid page cursor.")
+        query = query.filter(key < last if descending else key > last)
+
+    if descending:
+        query = query.order_by(sort_column.desc(), id_column.desc())
+    else:
+        query = query.order_by(sort_column, id_column)
+
+    rows = query.limit(per_page + 1).all()
+    next_cursor = None
+    if len(rows) > per_page:
+        rows = rows[:per_page]
+        last_row = rows[-1]
+        value = getattr(last_row, sort_column.key)
+        value = value.isoformat() if isinstance(value, datetime) else value
+        next_cursor = '{}|{}'.format(value, getattr(last_row, id_column.key))
+    return rows, next_cursor
+
+# Helper function to build the URL of the next page, keeping the current filters and sort
+def next_page_url(next_cursor):
+    if next_cursor is None:
+        return None
+    args = request.args.to_dict()
+    args.update(request.view_args or {})
+    args['after'] = next_cursor
+    return url_for(request.endpoint, **args)
+
+# Helper function returning an INSERT that supports ON CONFLICT for the configured database
+def upsert(model):
+    if db.engine.dialect.name == 'postgresql':
+        return postgresql.insert(model)
+    return sqlite.insert(model)
+
+# Add one donation to the running totals (caller commits together with the donation row)
+def record_donation_totals(donor_name, donor_type, amount, user_id=None):
+    stmt = upsert(DonationTotal).values(donor_type=donor_type, total=amount, donation_count=1)
+    db.session.execute(stmt.on_conflict_do_update(
+        index_elements=['donor_type'],
+        set_={'total': DonationTotal.total + amount, 'donation_count': DonationTotal.donation_count + 1}
+    ))
+    stmt = upsert(DonorTotal).values(donor_name=donor_name, donor_type=donor_type, total=amount)
+    db.session.execute(stmt.on_conflict_do_update(
+        index_elements=['donor_name'],
+        set_={'total': DonorTotal.total + amount, 'donor_type': donor_type}
+    ))
+    if user_id is not None:
+        updated = db.session.execute(
+            db.update(UserDonation)
+            .where(UserDonation.user_id == user_id)
+            .values(total_donated=UserDonation.total_donated + amount)
+        ).rowcount
+        if not updated:
+            db.session.add(UserDonation(user_id=user_id, total_donated=amount))
+
+# Rebuild the running totals from the donations table with set-based SQL
+def rebuild_donation_totals():
+    db.session.execute(db.delete(DonationTotal))
+    db.session.execute(db.delete(DonorTotal))
+    db.session.execute(db.insert(DonationTotal).from_select(
+        ['donor_type', 'total', 'donation_count'],
+        db.select(Donationsnew.donor_type, db.func.sum(Donationsnew.amount), db.func.count())
+        .group_by(Donationsnew.donor_type)
+    ))
+    db.session.execute(db.insert(DonorTotal).from_select(
+        ['donor_name', 'donor_type', 'total'],
+        db.select(Donationsnew.donor_name, db.func.max(Donationsnew.donor_type), db.func.sum(Donationsnew.amount))
+        .group_by(Donationsnew.donor_name)
+    ))
+    db.session.commit()
 
-    # Define the timezone for India (IST)
-    tz = pytz.timezone('Asia/Kolkata')
+# Helper function to restrict a string column to a prefix using an index-friendly range
+def prefix_filter(column, prefix):
+    return db.and_(column >= prefix, column < prefix + '\uffff')
+
+# Raised when the password hashing pool is full; answered with a 503 instead of tying up the worker
+class HashingBusy(Exception):
+    pass
+
+# Bounded pool that runs the CPU-heavy password hashes off the request thread
+class HashingPool:
+    def __init__(self, kind, workers, queue_limit):
+        self.executor = None
+        if kind == 'process':
+            # Imported here: concurrent.futures.process pulls in multiprocessing, which slows worker startup
+            from concurrent.futures import ProcessPoolExecutor
+            self.executor = ProcessPoolExecutor(max_workers=workers)
+        elif kind == 'thread':
+            self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='password-hash')
+        self.slots = threading.BoundedSemaphore(workers + queue_limit)
+
+    def run(self, func, *args, **kwargs):
+        if self.executor is None:
+            return func(*args, **kwargs)
+        if not self.slots.acquire(blocking=False):
+            raise HashingBusy()
+        try:
+            return self.executor.submit(func, *args, **kwargs).result()
+        finally:
+            self.slots.release()
+
+hashing_pool = HashingPool(app.config['PASSWORD_HASH_POOL'], app.config['PASSWORD_HASH_WORKERS'], app.config['PASSWORD_HASH_QUEUE_LIMIT'])
+import_hashing_pool = HashingPool(app.config['PASSWORD_HASH_POOL'], app.config['BULK_IMPORT_HASH_WORKERS'], 0)
+
+# Hash a password with the configured method; the method and its cost are stored in the hash prefix
+def hash_password(password):
+    return hashing_pool.run(generate_password_hash, password, method=app.config['PASSWORD_HASH_METHOD'])
+
+# Hash many passwords at once for bulk import, on the import pool rather than the one logins wait on
+def hash_passwords(passwords, method=None):
+    method = method or app.config['PASSWORD_HASH_METHOD']
+    if import_hashing_pool.executor is None:
+        return [generate_password_hash(password, method=method) for password in passwords]
+    return list(import_hashing_pool.executor.map(generate_password_hash, passwords, [method] * len(passwords)))
+
+def verify_password(password_hash, password):
+    return hashing_pool.run(check_password_hash, password_hash, password)
+
+# True when the hash was made with a different method or cost than the one configured now
+def password_needs_rehash(password_hash):
+    return password_hash.split('$', 1)[0] != app.config['PASSWORD_HASH_METHOD']
+
+@app.errorhandler(HashingBusy)
+def hashing_busy(error):
+    return "Server is busy, please try again in a moment.", 503, {'Retry-After': '1'}
+
+# Token bucket rate limiting, checked in before_request so a throttled request is rejected before any
+# ORM query or password hash. A bucket holds up to `requests` tokens and refills at requests/per per second.
+class MemoryBucketStore:
+    def __init__(self, max_keys, idle):
+        self.max_keys = max_keys
+        self.idle = idle
+        self.lock = threading.Lock()
+        self.buckets = {}
+
+    # Take one token from the bucket; returns 0 if allowed, else the seconds until a token is available
+    def take(self, key, capacity, rate):
+        now = time.monotonic()
+        with self.lock:
+            tokens, stamp = self.buckets.get(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - stamp) * rate)
+            if tokens < 1:
+                self.buckets[key] = (tokens, now)
+                return (1 - tokens) / rate
+            if len(self.buckets) >= self.max_keys and key not in self.buckets:
+                self.prune(now)
+            self.buckets[key] = (tokens - 1, now)
+            return 0
+
+    # Drop buckets idle for longer than the longest limit period; they have refilled and equal a missing bucket
+    def prune(self, now):
+        self.buckets = {key: value for key, value in self.buckets.items() if now - value[1] < self.idle}
+
+# Shared store for all workers on the host: one SQLite file (put it on tmpfs such as /dev/shm to keep it
+# in memory). Uses the sqlite3 module directly, one connection per thread, and one atomic upsert per check.
+class SqliteBucketStore:
+    def __init__(self, path):
+        self.path = path
+        self.local = threading.local()
+
+    def connection(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            import sqlite3
+            conn = sqlite3.connect(self.path, isolation_level=None, timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=OFF")
+            conn.execute("CREATE TABLE IF NOT EXISTS bucket (key TEXT PRIMARY KEY, tokens REAL NOT NULL, stamp REAL NOT NULL)")
+            self.local.conn = conn
+        return conn
+
+    def take(self, key, capacity, rate):
+        now = time.time()
+        conn = self.connection()
+        # The update only happens while a token is left, so the row count tells whether the request is allowed
+        allowed = conn.execute(
+            "INSERT INTO bucket (key, tokens, stamp) VALUES (:key, :capacity - 1, :now) "
+            "ON CONFLICT (key) DO UPDATE SET tokens = min(:capacity, tokens + (:now - stamp) * :rate) - 1, stamp = :now "
+            "WHERE min(:capacity, tokens + (:now - stamp) * :rate) >= 1",
+            {'key': key, 'capacity': capacity, 'rate': rate, 'now': now},
+        ).rowcount
+        if allowed:
+            return 0
+        tokens, stamp = conn.execute("SELECT tokens, stamp FROM bucket WHERE key = ?", (key,)).fetchone()
+        return (1 - min(capacity, tokens + (now - stamp) * rate)) / rate
+
+def make_bucket_store(storage):
+    if storage == 'memory':
+        idle = max([per for _, per, _ in app.config['RATE_LIMITS'].values()], default=0)
+        return MemoryBucketStore(app.config['RATE_LIMIT_MAX_KEYS'], idle)
+    return SqliteBucketStore(storage)
+
+bucket_store = make_bucket_store(app.config['RATE_LIMIT_STORAGE'])
+
+@app.before_request
+def check_rate_limit():
+    limit = app.config['RATE_LIMITS'].get(request.endpoint)
+    if limit is None or request.method not in app.config['RATE_LIMIT_METHODS']:
+        return None
+    requests_allowed, per, scope = limit
+    # Flask-Login keeps the user id in the signed session cookie, so no user needs to be loaded
+    who = session.get('_user_id') if scope == 'user' else None
+    key = '{}:{}'.format(request.endpoint, 'u' + who if who else request.remote_addr)
+    wait = bucket_store.take(key, requests_allowed, requests_allowed / per)
+    if wait:
+        return "Too many requests, please try again later.", 429, {'Retry-After': str(int(wait) + 1)}
+    return None
+
+# TTL + LRU cache of user identities in front of the Flask-Login user_loader. Entries are stored
+# with the user's generation from user_generations and only served while it is unchanged, so an edit
+# or delete in one worker is seen by every other worker on its next request.
+class UserCache:
+    def __init__(self, size, ttl):
+        self.size = size
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, user_id, version):
+        with self.lock:
+            entry = self.entries.get(user_id)
+            if entry is not None and entry[0] > time.monotonic() and entry[1] == version:
+                self.entries.move_to_end(user_id)
+                self.hits += 1
+                return entry[2]
+            if entry is not None:
+                del self.entries[user_id]
+            self.misses += 1
+            return None
+
+    def put(self, user_id, version, fields):
+        with self.lock:
+            self.entries[user_id] = (time.monotonic() + self.ttl, version, fields)
+            self.entries.move_to_end(user_id)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, user_id):
+        with self.lock:
+            self.entries.pop(user_id, None)
+
+    def stats(self):
+        with self.lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'size': len(self.entries),
+                'max_size': self.size,
+                'ttl': self.ttl,
+            }
 
-    # Get the UTC offset for the India time zone
-    india_offset = timedelta(seconds=tz.utcoffset(utc_now).total_seconds())
+user_cache = UserCache(app.config['USER_CACHE_SIZE'], app.config['USER_CACHE_TTL'])
+
+# Generation numbers shared by all worker processes through a memory-mapped file, one 8-byte slot
+# per user id (modulo the slot count). Reading one is a memory access, so a user cache hit costs no
+# query. A bump writes a new value rather than adding one, so two workers bumping the same slot at
+# once cannot leave it at a value a reader has already cached.
+class SharedGenerations:
+    SLOT = struct.Struct('=Q')
+
+    def __init__(self, path, slots):
+        self.path = path
+        self.slots = slots
+        self.lock = threading.Lock()
+        self.map = None
+
+    def open(self):
+        with self.lock:
+            if self.map is None:
+                os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+                fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+                try:
+                    size = self.slots * self.SLOT.size
+                    if os.fstat(fd).st_size < size:
+                        os.ftruncate(fd, size)
+                    self.map = mmap.mmap(fd, size)
+                finally:
+                    os.close(fd)
+        return self.map
+
+    def get(self, key):
+        return self.SLOT.unpack_from(self.open(), (key % self.slots) * self.SLOT.size)[0]
+
+    def bump(self, key):
+        offset = (key % self.slots) * self.SLOT.size
+        generations = self.open()
+        value = time.time_ns()
+        if value == self.SLOT.unpack_from(generations, offset)[0]:
+            value += 1
+        self.SLOT.pack_into(generations, offset, value)
+
+user_generations = SharedGenerations(app.config['USER_GENERATIONS_FILE'], app.config['USER_GENERATIONS_SLOTS'])
+
+# Bump a user's generation after changing or deleting the user. Call it after the commit: a worker
+# that reads the old generation while the change is still uncommitted then caches the old row
+# under a generation that is already out of date.
+def invalidate_user(user_id):
+    user_generations.bump(user_id)
+    user_cache.invalidate(user_id)
+
+# Logged-in user built from cached columns; anything else is read from the User row on first use
+class CachedUser(UserMixin):
+    def __init__(self, fields):
+        self.__dict__.update(fields)
+        self._record = None
+
+    @property
+    def record(self):
+        if self._record is None:
+            self._record = db.session.get(User, self.id)
+        return self._record
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self.record, name)
+
+@login_manager.user_loader
+def load_user(user_id):
+    user_id = int(user_id)
+    # Read before the row, so a change committed in between is seen as a new generation next time
+    version = user_generations.get(user_id)
+    fields = user_cache.get(user_id, version)
+    if fields is None:
+        columns = app.config['USER_CACHE_COLUMNS']
+        if columns:
+            row = db.session.execute(
+                db.select(*[getattr(User, column) for column in columns]).where(User.id == user_id)
+            ).first()
+            if row is None:
+                return None
+            fields = dict(row._mapping)
+        else:
+            user = db.session.get(User, user_id)
+            if user is None:
+                return None
+            fields = dict((column.key, getattr(user, column.key)) for column in User.__table__.columns)
+        user_cache.put(user_id, version, fields)
+    return CachedUser(fields)
+
+# Helper function to load games with their teams and members in a fixed number of queries
+def load_dashboard_data(game_ids):
+    # games -> teams -> members are loaded with one SELECT per level, no lazy loads in the template
+    games = Game.query.options(
+        selectinload(Game.teams).selectinload(Team.members)
+    ).filter(Game.id.in_(game_ids)).order_by(Game.id).all()
+
+    member_counts = {}
+    for game in games:
+        for team in game.teams:
+            member_counts[team.id] = team.member_count
+
+    return games, member_counts
+
+# Rendered game cards, keyed by game id and stored with the game version they were rendered at
+game_card_cache = {}
+game_card_lock = threading.Lock()
+GAME_CARD_MARKER = re.compile(r'<!--team-actions:(\d+):(\d)-->')
+
+# Helper function to read the version of every game (bumped by each route that changes a card)
+def game_versions():
+    rows = db.session.execute(db.select(Counter.name, Counter.value).where(Counter.name.like('game:%')))
+    return dict((int(name[len('game:'):]), value) for name, value in rows)
+
+# Bump the card version of the given games; runs in the caller's transaction
+def bump_game_versions(*game_ids):
+    names = ['game:{}'.format(game_id) for game_id in set(game_ids) if game_id is not None]
+    # 'games' is the change version of the whole games/teams/rosters data set, bumped on every call
+    now = datetime.utcnow()
+    for name in names + ['games']:
+        stmt = upsert(Counter).values(name=name, value=1, updated_at=now)
+        db.session.execute(stmt.on_conflict_do_update(
+            index_elements=['name'], set_={'value': Counter.value + 1, 'updated_at': now}
+        ))
+
+# Bump the cards of every game the user has a team in (their name and details are shown there)
+def bump_user_game_versions(user_id):
+    game_ids = db.session.execute(
+        db.select(Team.game_id).join(user_team, user_team.c.team_id == Team.id).where(user_team.c.user_id == user_id).distinct()
+    ).scalars().all()
+    bump_game_versions(*game_ids)
+
+# Helper function to split a rendered card into (html, team_id, team_full) segments at the team-actions markers
+def split_game_card(html):
+    parts = GAME_CARD_MARKER.split(html)
+    segments = []
+    for i in range(0, len(parts) - 1, 3):
+        segments.append((Markup(parts[i]), int(parts[i + 1]), parts[i + 2] == '1'))
+    segments.append((Markup(parts[-1]), None, False))
+    return segments
+
+# Return the dashboard game cards, re-rendering only the games whose version changed
+def render_game_cards(user):
+    game_ids = db.session.execute(db.select(Game.id).order_by(Game.id)).scalars().all()
+    # Versions are read before the data, so a card is never stored under a newer version than its content
+    versions = game_versions()
+    with game_card_lock:
+        stale_ids = [game_id for game_id in game_ids
+                     if game_card_cache.get(game_id, (None,))[0] != versions.get(game_id, 0)]
+
+    if stale_ids:
+        games, member_counts = load_dashboard_data(stale_ids)
+        rendered = {}
+        for game in games:
+            html = render_template('game_card.html', game=game, member_counts=member_counts, image_widths=app.config['IMAGE_WIDTHS'])
+            rendered[game.id] = (versions.get(game.id, 0), split_game_card(html))
+        with game_card_lock:
+            game_card_cache.update(rendered)
+
+    # Teams the current user belongs to, so the template never scans team.members
+    my_team_ids = set(
+        row.team_id for row in db.session.execute(
+            db.select(user_team.c.team_id).where(user_team.c.user_id == user.id)
+        )
+    )
+
+    with game_card_lock:
+        for game_id in set(game_card_cache) - set(game_ids):
+            del game_card_cache[game_id]
+        cards = [game_card_cache[game_id][1] for game_id in game_ids if game_id in game_card_cache]
+    return cards, my_team_ids
+
+# Shared clock: the formatted local date/time and greeting are worked out once per minute
+# and handed to every template, instead of doing timezone math on each request
+class Clock:
+    def __init__(self, timezone_name):
+        self.timezone_name = timezone_name
+        self.timezone = None
+        self.current = (None, {})
+
+    def tz(self):
+        # pytz and its zone data are loaded on first use only
+        if self.timezone is None:
+            import pytz
+            self.timezone = pytz.timezone(self.timezone_name)
+        return self.timezone
+
+    def context(self):
+        minute = int(time.time() // 60)
+        cached_minute, values = self.current
+        if cached_minute != minute:
+            local_time = datetime.now(self.tz())
+            hour = local_time.hour
+            # Determine the time of day based on the current hour
+            if 5 <= hour < 12:
+                time_of_day = 'Morning'
+            elif 12 <= hour < 17:
+                time_of_day = 'Afternoon'
+            elif 17 <= hour < 21:
+                time_of_day = 'Evening'
+            else:
+                time_of_day = 'Night'
+            values = {
+                'date': local_time.strftime("%Y-%m-%d"),
+                'time': local_time.strftime("%I:%M %p"),
+                'year': local_time.strftime("%Y"),
+                'time_of_day': time_of_day,
+            }
+            # Replaced in one assignment, so concurrent readers see either the old or the new minute
+            self.current = (minute, values)
+        return values
 
-    # Add the UTC offset to the current UTC time to get India time
-    india_time = utc_now + india_offset
+    # Convert a naive UTC timestamp from the database to the display timezone
+    def localize(self, value):
+        if value is None:
+            return value
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        return value.astimezone(self.tz())
 
-    # Extract date and time components in 12-hour format
-    date = india_time.strftime("%Y-%m-%d")
-    time = india_time.strftime("%I:%M %p")
+clock = Clock(app.config['DISPLAY_TIMEZONE'])
 
-    # Extract only the year from the date
-    year = india_time.strftime("%Y")
+@app.context_processor
+def clock_context():
+    return clock.context()
 
-    # Get the current hour in the India time zone
-    india_hour = india_time.hour
+@app.template_filter('local_time')
+def local_time_filter(value):
+    return clock.localize(value)
 
-    # Determine the time of day based on the current hour
-    if 5 <= india_hour < 12:
-        time_of_day = 'Morning'
-    elif 12 <= india_hour < 17:
-        time_of_day = 'Afternoon'
-    elif 17 <= india_hour < 21:
-        time_of_day = 'Evening'
-    else:
-        time_of_day = 'Night'
-    
+@app.route('/')
+@login_required
+def dashboard():
     # Get the visitor count
-    visitor_count = get_visitor_count()
+    visitor_count = visitor_counter.increment('visitors')
     username = current_user.fname  # Get the username of the current user
     
-    # Fetch all games from the database
-    games = Game.query.all()
+    # Game cards come from the fragment cache; only changed games are loaded and rendered
+    game_cards, my_team_ids = render_game_cards(current_user)
 
-    return render_template("main.html", games=games, username=username, time_of_day=time_of_day, date=date, time=time, year=year, visitor_count=visitor_count)
+    # date, time, year and time_of_day come from the clock context processor
+    return render_template("main.html", game_cards=game_cards, my_team_ids=my_team_ids, username=username, visitor_count=visitor_count)
 
 @app.route('/login', methods=['GET', 'POST'])
 def login():
@@ -130,7 +1192,11 @@ def login():
         password = request.form['password']
         user = User.query.filter_by(username=username).first()
 
-        if user and check_password_hash(user.password, password):
+        if user and verify_password(user.password, password):
+            # Upgrade hashes made with an older method or cost while we have the plain password
+            if password_needs_rehash(user.password):
+                user.password = hash_password(password)
+                db.session.commit()
             login_user(user)
             flash('Logged in successfully.', 'success')
             return redirect(url_for('dashboard'))
@@ -140,6 +1206,7 @@ def login():
     return render_template('login.html')
 
 @app.route('/register', methods=['GET', 'POST'])
+@retry_on_busy
 def register():
     if request.method == 'POST':
         fname = request.form['fname']
@@ -161,7 +1228,7 @@ def register():
             if existing_user:
                 flash('Email already exists. Please choose a different email.', 'error')
             else:
-                hashed_password = generate_password_hash(password)
+                hashed_password = hash_password(password)
                 new_user = User(
                     fname=fname,
                     username=username,
@@ -182,14 +1249,18 @@ def register():
 
 @app.route('/create_team/<int:game_id>', methods=['GET', 'POST'])
 @login_required
+@retry_on_busy
 def create_team(game_id):
     game = Game.query.get(game_id)
     if game:
         if request.method == 'POST':
             team_name = request.form['team_name']
 
-            new_team = Team(name=team_name, game=game, members=[current_user])
+            new_team = Team(name=team_name, game=game, members=[current_user.record], member_count=1)
             db.session.add(new_team)
+            db.session.flush()
+            bump_game_versions(game.id)
+            publish_roster_event('team_created', new_team.id, game.id, team_name, current_user.id, current_user.fname)
             db.session.commit()
 
             flash('Team created successfully!', 'success')
@@ -202,15 +1273,22 @@ def create_team(game_id):
 
 @app.route('/join_team/<int:team_id>', methods=['POST'])
 @login_required
+@retry_on_busy
 def join_team(team_id):
-    team = Team.query.get(team_id)
+    team = db.session.execute(db.select(Team.name, Team.game_id).where(Team.id == team_id)).first()
     if team:
-        if current_user not in team.members:
-            team.members.append(current_user)
+        result = add_team_member(current_user.id, team_id)
+        if result == 'joined':
+            bump_game_versions(team.game_id)
+            publish_roster_event('joined', team_id, team.game_id, team.name, current_user.id, current_user.fname)
             db.session.commit()
             flash('Joined team {}!'.format(team.name), 'success')
-        else:
+        elif result == 'member':
+            db.session.rollback()
             flash('You are already a member of this team.', 'info')
+        else:
+            db.session.rollback()
+            flash('Team {} is full.'.format(team.name), 'error')
     else:
         flash('Team not found.', 'error')
 
@@ -218,11 +1296,13 @@ def join_team(team_id):
 
 @app.route('/leave_team/<int:team_id>', methods=['POST'])
 @login_required
+@retry_on_busy
 def leave_team(team_id):
-    team = Team.query.get(team_id)
+    team = db.session.execute(db.select(Team.name, Team.game_id).where(Team.id == team_id)).first()
     if team:
-        if current_user in team.members:
-            team.members.remove(current_user)
+        if remove_team_member(current_user.id, team_id):
+            bump_game_versions(team.game_id)
+            publish_roster_event('left', team_id, team.game_id, team.name, current_user.id, current_user.fname)
             db.session.commit()
             flash('You have left the team.', 'success')
         else:
@@ -232,13 +1312,160 @@ def leave_team(team_id):
 
     return redirect(url_for('dashboard'))
 
+# Raised by matchmake when an open team filled up between reading its seats and topping it up
+class TeamsChanged(Exception):
+    pass
+
+# Matchmaking: place every signed-up user of a game who has no team in it yet. Open teams are topped up
+# first and new teams are created for the rest. Players are sorted by (user_class, year, gender) and dealt
+# round-robin over the teams, so each attribute group is spread evenly and team sizes differ by at most one.
+# All assignments are written with a few executemany statements. Returns (players placed, teams created).
+# The caller commits, or rolls back on an exception.
+def matchmake(game):
+    if game.team_size is None or int(game.team_size) < 1:
+        raise ValueError("Game {} needs a team size of at least 1 for matchmaking.".format(game.id))
+    team_size = int(game.team_size)
+    # Write first: on SQLite this takes the write lock (like BEGIN IMMEDIATE), so no join can change the
+    # seats read below before the caller commits; other databases lock the open teams with FOR UPDATE
+    bump_game_versions(game.id)
+    in_game = db.select(user_team.c.user_id).join(Team, Team.id == user_team.c.team_id).where(Team.game_id == game.id)
+    players = db.session.execute(
+        db.select(User.id, User.user_class, User.year, User.gender)
+        .join(GameSignup, GameSignup.user_id == User.id)
+        .where(GameSignup.game_id == game.id, User.id.not_in(in_game))
+    ).all()
+    if not players:
+        return 0, 0
+    players.sort(key=lambda player: (player.user_class or '', player.year or '', player.gender or '', player.id))
+
+    # [team key, free seats]: open teams by id first, then the new teams to create as -1, -2, ...
+    seats = [list(row) for row in db.session.execute(
+        db.select(Team.id, team_size - Team.member_count)
+        .where(Team.game_id == game.id, Team.member_count < team_size)
+        .order_by(Team.id).with_for_update()
+    )]
+    missing = len(players) - sum(free for _, free in seats)
+    new_team_count = max(0, -(-missing // team_size))
+    seats.extend([-i, team_size] for i in range(1, new_team_count + 1))
+
+    # Each pass gives one player to every team that still has a free seat
+    placements, added = [], {}
+    remaining = iter(players)
+    while len(placements) < len(players):
+        still_open = []
+        for seat in seats:
+            player = next(remaining, None)
+            if player is None:
+                break
+            placements.append((player.id, seat[0]))
+            added[seat[0]] = added.get(seat[0], 0) + 1
+            seat[1] -= 1
+            if seat[1]:
+                still_open.append(seat)
+        seats = still_open
+
+    # New teams are inserted with their final member_count; only the open teams need an UPDATE
+    team_ids = {}
+    if new_team_count:
+        team_count = db.session.execute(db.select(db.func.count()).where(Team.game_id == game.id)).scalar()
+        names = {-i: '{} Team {}'.format(game.game_name, team_count + i) for i in range(1, new_team_count + 1)}
+        created = db.session.execute(Team.__table__.insert().returning(Team.id, Team.name), [
+            {'name': name, 'game_id': game.id, 'member_count': added[key]} for key, name in names.items()
+        ])
+        ids_by_name = {name: team_id for team_id, name in created}
+        team_ids = {key: ids_by_name[name] for key, name in names.items()}
+    open_counts = [{'b_team_id': key, 'b_added': count} for key, count in added.items() if key > 0]
+    if open_counts:
+        # The capacity check is repeated in the UPDATE; if a team filled up anyway, give up so the
+        # caller rolls back (a matchmake job is then retried)
+        updated = db.session.execute(
+            Team.__table__.update()
+            .where(Team.id == db.bindparam('b_team_id'), Team.member_count + db.bindparam('b_added') <= team_size)
+            .values(member_count=Team.member_count + db.bindparam('b_added')),
+            open_counts
+        ).rowcount
+        if updated != len(open_counts):
+            raise TeamsChanged("Open teams of game {} changed during matchmaking.".format(game.id))
+    db.session.execute(user_team.insert(), [
+        {'user_id': user_id, 'team_id': team_ids.get(key, key)} for user_id, key in placements
+    ])
+    db.session.execute(RosterEvent.__table__.insert(), [
+        {'kind': 'matchmade', 'team_id': team_ids.get(key, key), 'game_id': game.id} for key in added
+    ])
+    return len(placements), new_team_count
+
+@job_handler('matchmake')
+def matchmake_job(game_id):
+    game = db.session.get(Game, game_id)
+    if game is None:
+        return None
+    placed, created = matchmake(game)
+    return {'game_id': game_id, 'placed': placed, 'teams': created}
+
+# Sign up for a game's matchmaking
+@app.route('/signup/<int:game_id>', methods=['POST'])
+@login_required
+@retry_on_busy
+def signup_game(game_id):
+    if db.session.get(Game, game_id) is None:
+        flash('Game not found.', 'error')
+        return redirect(url_for('dashboard'))
+    stmt = upsert(GameSignup).values(game_id=game_id, user_id=current_user.id)
+    db.session.execute(stmt.on_conflict_do_nothing(index_elements=['game_id', 'user_id']))
+    db.session.commit()
+    flash('You are signed up. You will be placed in a team when matchmaking runs.', 'success')
+    return redirect(url_for('dashboard'))
+
+# Admin Panel - Place all signed-up players of a game into balanced teams
+@app.route('/admin/matchmake/<int:game_id>', methods=['POST'])
+@login_required
+@retry_on_busy
+def admin_matchmake(game_id):
+    if current_user.is_authenticated and current_user.username == "admin":
+        game = db.session.get(Game, game_id)
+        if game is None:
+            flash("Game not found.", 'error')
+        elif int(game.team_size or 0) < 1:
+            flash("Set a team size of at least 1 before running matchmaking.", 'error')
+        else:
+            enqueue('matchmake', priority=1, dedupe_key='matchmake:{}'.format(game_id), game_id=game_id)
+            db.session.commit()
+            flash("Matchmaking for '{}' has been queued.".format(game.game_name), 'success')
+        return redirect(url_for('list_games'))
+
+    flash("You do not have permission to access the Admin panel.", 'error')
+    return redirect(url_for('dashboard'))
+
+# CLI - flask --app app matchmake 3
+@app.cli.command('matchmake')
+@click.argument('game_id', type=int)
+def matchmake_command(game_id):
+    with app.app_context():
+        game = db.session.get(Game, game_id)
+        if game is None:
+            raise click.ClickException("Game {} not found.".format(game_id))
+        start = time.perf_counter()
+        try:
+            placed, created = matchmake(game)
+        except (ValueError, TeamsChanged) as error:
+            db.session.rollback()
+            raise click.ClickException(str(error))
+        db.session.commit()
+    click.echo("Placed {} players ({} new teams) in {:.2f} s.".format(placed, created, time.perf_counter() - start))
+
   
 @app.route('/users')
 @login_required
 def list_users():
     if current_user.username == "admin":
-        users = User.query.all()
-        return render_template('user_list.html', users=users)
+        query = User.query
+        username_prefix = request.args.get('username', '').strip()
+        if username_prefix:
+            query = query.filter(prefix_filter(User.username, username_prefix))
+        sort_column = User.username if request.args.get('sort') == 'username' else User.id
+
+        users, next_cursor = keyset_page(query, sort_column, User.id)
+        return render_template('user_list.html', users=users, next_url=next_page_url(next_cursor))
     else:
         flash("You do not have permission to access Admin page.", 'error')
         return redirect(url_for('dashboard'))
@@ -250,11 +1477,22 @@ def delete_user(user_id):
         if current_user.id == user_id:
             flash("You cannot delete your own account.", 'error')
         else:
-            user = User.query.get(user_id)
-            if user:
-                db.session.delete(user)
+            username = db.session.execute(db.select(User.username).where(User.id == user_id)).scalar()
+            if username:
+                bump_user_game_versions(user_id)
+                db.session.execute(
+                    db.update(Team)
+                    .where(Team.id.in_(db.select(user_team.c.team_id).where(user_team.c.user_id == user_id)))
+                    .values(member_count=Team.member_count - 1)
+                )
+                # Children first, so this also works on databases created before the ON DELETE CASCADE keys
+                db.session.execute(user_team.delete().where(user_team.c.user_id == user_id))
+                db.session.execute(db.delete(GameSignup).where(GameSignup.user_id == user_id))
+                db.session.execute(db.delete(UserDonation).where(UserDonation.user_id == user_id))
+                db.session.execute(db.delete(User).where(User.id == user_id))
                 db.session.commit()
-                flash("User '{}' has been deleted.".format(user.username), 'success')
+                invalidate_user(user_id)
+                flash("User '{}' has been deleted.".format(username), 'success')
             else:
                 flash("User not found.", 'error')
     else:
@@ -272,13 +1510,143 @@ def admin_panel():
     flash("You do not have permission to access the Admin panel.", 'error')
     return redirect(url_for('dashboard'))
 
+# Game images: uploads are stored under content-addressed names, and a job makes the card thumbnails
+# (WebP and JPEG at each IMAGE_WIDTHS) once per distinct image. Pillow is only needed by that job.
+IMAGE_EXTENSIONS = {'.png', '.jpg', '.jpeg', '.gif', '.webp'}
+IMAGE_URL_PREFIX = '/images/'
+
+# Helper function to store uploaded image bytes as <sha256>.<ext>; returns the file name
+def store_image(data, extension):
+    name = hashlib.sha256(data).hexdigest()[:32] + extension
+    path = os.path.join(app.config['IMAGE_DIR'], name)
+    if not os.path.exists(path):
+        os.makedirs(app.config['IMAGE_DIR'], exist_ok=True)
+        temp_path = '{}.{}.tmp'.format(path, os.getpid())
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, path)
+    return name
+
+# Helper function taking the image of an add/modify game form: an upload wins over the URL field.
+# Returns the game_image value, or None (after flashing why) when neither is usable.
+def game_image_from_form(current=None):
+    upload = request.files.get('gameImageFile')
+    if upload and upload.filename:
+        extension = os.path.splitext(upload.filename)[1].lower()
+        data = upload.read(app.config['IMAGE_MAX_BYTES'] + 1)
+        if extension not in IMAGE_EXTENSIONS or len(data) > app.config['IMAGE_MAX_BYTES']:
+            flash("Please upload a PNG, JPEG, GIF or WebP image of at most {} MB.".format(app.config['IMAGE_MAX_BYTES'] // 2 ** 20), 'error')
+            return None
+        return IMAGE_URL_PREFIX + store_image(data, extension)
+    url = request.form.get('gameImage', '').strip()
+    if url:
+        return url
+    if current is None:
+        flash("Please upload an image or enter an image URL.", 'error')
+    return current
+
+# Queue the thumbnails of a game's new image; the card shows the original until they exist
+def queue_game_thumbnails(game):
+    game.image_key = None
+    enqueue('game_thumbnails', priority=2, dedupe_key='thumbnails:{}'.format(game.id), game_id=game.id)
+
+# Helper function refusing image URLs that are not http(s) or whose host resolves to a private,
+# loopback, link-local or otherwise non-public address, so game images cannot reach internal services
+def check_public_image_url(url):
+    import ipaddress
+    import socket
+    import urllib.parse
+    parts = urllib.parse.urlsplit(url)
+    if parts.scheme not in ('http', 'https') or not parts.hostname:
+        raise ValueError("Unsupported image URL: {}".format(url))
+    try:
+        addresses = socket.getaddrinfo(parts.hostname, parts.port or (443 if parts.scheme == 'https' else 80), proto=socket.IPPROTO_TCP)
+    except socket.gaierror:
+        raise ValueError("Cannot resolve image host: {}".format(parts.hostname))
+    for address in addresses:
+        if not ipaddress.ip_address(address[4][0].split('%')[0]).is_global:
+            raise ValueError("Image host is not a public address: {}".format(parts.hostname))
+
+# Helper function reading the source bytes of an image: a stored upload, or a download of a public
+# http(s) URL. Every redirect target is checked like the URL itself.
+def read_image_source(source):
+    if source.startswith(IMAGE_URL_PREFIX):
+        with open(os.path.join(app.config['IMAGE_DIR'], os.path.basename(source[len(IMAGE_URL_PREFIX):])), 'rb') as f:
+            return f.read()
+    import urllib.request
+
+    class PublicRedirectHandler(urllib.request.HTTPRedirectHandler):
+        def redirect_request(self, req, fp, code, msg, headers, newurl):
+            check_public_image_url(newurl)
+            return super().redirect_request(req, fp, code, msg, headers, newurl)
+
+    check_public_image_url(source)
+    opener = urllib.request.build_opener(PublicRedirectHandler)
+    image_request = urllib.request.Request(source, headers={'User-Agent': 'game-management-system'})
+    with opener.open(image_request, timeout=10) as response:
+        data = response.read(app.config['IMAGE_MAX_BYTES'] + 1)
+    if len(data) > app.config['IMAGE_MAX_BYTES']:
+        raise ValueError("Image is larger than {} bytes".format(app.config['IMAGE_MAX_BYTES']))
+    return data
+
+@job_handler('game_thumbnails')
+def game_thumbnails_job(game_id):
+    game = db.session.get(Game, game_id)
+    if game is None:
+        return None
+    source = game.game_image
+    data = read_image_source(source)
+    key = hashlib.sha256(data).hexdigest()[:32]
+    widths = app.config['IMAGE_WIDTHS']
+    directory = app.config['IMAGE_DIR']
+    os.makedirs(directory, exist_ok=True)
+    # Another game may already use the same image
+    if not all(os.path.exists(os.path.join(directory, '{}-{}.webp'.format(key, width))) for width in widths):
+        from PIL import Image, ImageOps
+        image = ImageOps.exif_transpose(Image.open(io.BytesIO(data)))
+        image = image.convert('RGB')
+        for width in widths:
+            thumbnail = ImageOps.fit(image, (width, width // 2), Image.LANCZOS)
+            for extension, options in (('webp', {'quality': 80, 'method': 6}), ('jpg', {'quality': 82, 'progressive': True, 'optimize': True})):
+                path = os.path.join(directory, '{}-{}.{}'.format(key, width, extension))
+                temp_path = '{}.{}.tmp'.format(path, os.getpid())
+                thumbnail.save(temp_path, 'WEBP' if extension == 'webp' else 'JPEG', **options)
+                os.replace(temp_path, path)
+    # Only attach the thumbnails if the game still shows the image they were made from
+    updated = db.session.execute(
+        db.update(Game).where(Game.id == game_id, Game.game_image == source).values(image_key=key)
+    ).rowcount
+    if updated:
+        bump_game_versions(game_id)
+    return {'game_id': game_id, 'image_key': key}
+
+# Stored images and thumbnails; their names change with their content, so browsers may cache them forever
+@app.route(IMAGE_URL_PREFIX + '<name>')
+def game_image(name):
+    response = send_from_directory(app.config['IMAGE_DIR'], name, max_age=app.config['IMAGE_CACHE_MAX_AGE'])
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+# CLI - flask --app app make-thumbnails: queue thumbnails for every game that has none yet
+@app.cli.command('make-thumbnails')
+def make_thumbnails_command():
+    with app.app_context():
+        games = Game.query.filter(Game.image_key.is_(None)).all()
+        for game in games:
+            queue_game_thumbnails(game)
+        db.session.commit()
+    click.echo("Queued thumbnails for {} games.".format(len(games)))
+
 # Admin Panel - Add New Game
 @app.route('/admin/add_game', methods=['GET', 'POST'])
 @login_required
 def add_game():
     if current_user.is_authenticated and current_user.username == "admin":
         if request.method == 'POST':
-            game_image = request.form['gameImage']
+            game_image = game_image_from_form()
+            if game_image is None:
+                return render_template('add_game.html')
             game_name = request.form['gameName']
             game_details = request.form['gameDetails']
             team_size = request.form['teamsize']
@@ -291,6 +1659,9 @@ def add_game():
                 team_size=team_size
             )
             db.session.add(new_game)
+            db.session.flush()
+            queue_game_thumbnails(new_game)
+            bump_game_versions(new_game.id)
             db.session.commit()
             flash("Game added successfully.", 'success')
             return redirect(url_for('admin_panel'))
@@ -304,8 +1675,14 @@ def add_game():
 @login_required
 def list_games():
     if current_user.is_authenticated and current_user.username == "admin":
-        games = Game.query.all()
-        return render_template('list_games.html', games=games)
+        query = Game.query
+        name_prefix = request.args.get('name', '').strip()
+        if name_prefix:
+            query = query.filter(prefix_filter(Game.game_name, name_prefix))
+        sort_column = Game.game_name if request.args.get('sort') == 'name' else Game.id
+
+        games, next_cursor = keyset_page(query, sort_column, Game.id)
+        return render_template('list_games.html', games=games, next_url=next_page_url(next_cursor))
 
     flash("You do not have permission to access the Admin panel.", 'error')
     return redirect(url_for('dashboard'))
@@ -322,10 +1699,16 @@ def modify_game(game_id):
             return redirect(url_for('admin_panel'))
 
         if request.method == 'POST':
-            game_to_modify.game_image = request.form['gameImage']
+            game_image = game_image_from_form(game_to_modify.game_image)
+            if game_image is None:
+                return render_template('modify_game.html', game=game_to_modify)
+            if game_image != game_to_modify.game_image:
+                game_to_modify.game_image = game_image
+                queue_game_thumbnails(game_to_modify)
             game_to_modify.game_name = request.form['gameName']
             game_to_modify.game_details = request.form['gameDetails']
             game_to_modify.team_size = request.form['teamsize']
+            bump_game_versions(game_id)
 
             db.session.commit()
             flash("Game updated successfully.", 'success')
@@ -337,19 +1720,143 @@ def modify_game(game_id):
     return redirect(url_for('dashboard'))
 
 
+# Soft-delete a game and its teams with two UPDATEs; returns False if there is no such live game
+def soft_delete_game(game_id):
+    now = datetime.utcnow()
+    deleted = db.session.execute(
+        db.update(Game).where(Game.id == game_id, Game.deleted_at.is_(None)).values(deleted_at=now)
+    ).rowcount
+    if deleted:
+        db.session.execute(db.update(Team).where(Team.game_id == game_id, Team.deleted_at.is_(None)).values(deleted_at=now))
+        db.session.execute(db.delete(GameSignup).where(GameSignup.game_id == game_id))
+        bump_game_versions(game_id)
+    return bool(deleted)
+
+# Delete rows whose parent is gone (left behind by deletes before the foreign keys were enforced).
+# Children go first, so this also works on databases created before the ON DELETE CASCADE keys.
+def purge_orphans():
+    live_users = db.select(User.id)
+    orphan_teams = db.select(Team.id).where(db.or_(Team.game_id.is_(None), Team.game_id.not_in(db.select(Game.id))))
+    counts = {}
+    counts['memberships'] = db.session.execute(user_team.delete().where(db.or_(
+        user_team.c.team_id.in_(orphan_teams),
+        user_team.c.team_id.not_in(db.select(Team.id)),
+        user_team.c.user_id.not_in(live_users),
+    ))).rowcount
+    counts['teams'] = db.session.execute(db.delete(Team).where(Team.id.in_(orphan_teams))).rowcount
+    counts['signups'] = db.session.execute(db.delete(GameSignup).where(db.or_(
+        GameSignup.game_id.not_in(db.select(Game.id)), GameSignup.user_id.not_in(live_users),
+    ))).rowcount
+    counts['donation_totals'] = db.session.execute(
+        db.delete(UserDonation).where(UserDonation.user_id.not_in(live_users))
+    ).rowcount
+    return counts
+
+# Hard-delete games and teams soft-deleted before the cutoff (teams archived by end_of_season() are kept
+# unless their game goes), then any orphans. Set-based statements only; the caller commits.
+def purge_deleted(cutoff):
+    games = db.select(Game.id).where(Game.deleted_at < cutoff)
+    teams = db.select(Team.id).where(db.or_(
+        Team.game_id.in_(games),
+        db.and_(Team.deleted_at < cutoff, Team.season.is_(None)),
+    ))
+    counts = {}
+    counts['memberships'] = db.session.execute(user_team.delete().where(user_team.c.team_id.in_(teams))).rowcount
+    counts['teams'] = db.session.execute(db.delete(Team).where(Team.id.in_(teams))).rowcount
+    db.session.execute(db.delete(GameSignup).where(GameSignup.game_id.in_(games)))
+    counts['games'] = db.session.execute(db.delete(Game).where(Game.id.in_(games))).rowcount
+    for name, count in purge_orphans().items():
+        counts[name] = counts.get(name, 0) + count
+    return counts
+
+# End of season: archive every live team (soft-deleted and labelled with the season) and move all donations
+# to donation_archive, then reset the running totals and sign-ups. One transaction of set-based statements;
+# no rows are loaded into Python. The caller commits.
+def end_of_season(season):
+    now = datetime.utcnow()
+    counts = {}
+    counts['teams'] = db.session.execute(
+        db.update(Team).where(Team.deleted_at.is_(None)).values(deleted_at=now, season=season)
+    ).rowcount
+    columns = ('donor_name', 'donor_type', 'amount', 'donation_date')
+    db.session.execute(db.insert(DonationArchive).from_select(
+        ('season', 'archived_at') + columns,
+        db.select(db.literal(season), db.literal(now, db.DateTime), *[getattr(Donationsnew, column) for column in columns]),
+    ))
+    counts['donations'] = db.session.execute(db.delete(Donationsnew)).rowcount
+    for model in (DonationTotal, DonorTotal, UserDonation, GameSignup):
+        db.session.execute(db.delete(model))
+    # Totals still queued for archived donations would land in the new season
+    db.session.execute(db.delete(Job).where(Job.name == 'record_donation_totals', Job.status == 'queued'))
+    # Every game card changes; bump all game versions in one statement
+    db.session.execute(
+        db.update(Counter).where(Counter.name.like('game:%')).values(value=Counter.value + 1, updated_at=now)
+    )
+    bump_game_versions()
+    return counts
+
+# Admin Panel - End of season
+@app.route('/admin/end_season', methods=['POST'])
+@login_required
+@retry_on_busy
+def admin_end_season():
+    if current_user.is_authenticated and current_user.username == "admin":
+        season = request.form.get('season', '').strip()
+        if not season:
+            flash("Please name the season being closed.", 'error')
+        else:
+            counts = end_of_season(season)
+            db.session.commit()
+            flash("Season '{}' archived: {} teams and {} donations.".format(season, counts['teams'], counts['donations']), 'success')
+        return redirect(url_for('admin_panel'))
+
+    flash("You do not have permission to access the Admin panel.", 'error')
+    return redirect(url_for('dashboard'))
+
+# Admin Panel - Purge deleted games and teams past the retention period
+@app.route('/admin/purge', methods=['POST'])
+@login_required
+@retry_on_busy
+def admin_purge():
+    if current_user.is_authenticated and current_user.username == "admin":
+        cutoff = datetime.utcnow() - timedelta(days=app.config['SOFT_DELETE_RETENTION_DAYS'])
+        counts = purge_deleted(cutoff)
+        db.session.commit()
+        flash("Purged {} games, {} teams and {} memberships.".format(counts['games'], counts['teams'], counts['memberships']), 'success')
+        return redirect(url_for('admin_panel'))
+
+    flash("You do not have permission to access the Admin panel.", 'error')
+    return redirect(url_for('dashboard'))
+
+# CLI - flask --app app purge-deleted --days 0
+@app.cli.command('purge-deleted')
+@click.option('--days', type=int, help='Retention in days (default SOFT_DELETE_RETENTION_DAYS)')
+def purge_deleted_command(days):
+    with app.app_context():
+        days = app.config['SOFT_DELETE_RETENTION_DAYS'] if days is None else days
+        counts = purge_deleted(datetime.utcnow() - timedelta(days=days))
+        db.session.commit()
+    click.echo(", ".join("{} {}".format(count, name) for name, count in counts.items()) + " purged.")
+
+# CLI - flask --app app end-season 2023
+@app.cli.command('end-season')
+@click.argument('season')
+def end_season_command(season):
+    with app.app_context():
+        counts = end_of_season(season)
+        db.session.commit()
+    click.echo("Season '{}' archived: {} teams and {} donations.".format(season, counts['teams'], counts['donations']))
+
 # Admin Panel - Delete Game
 @app.route('/admin/delete_game/<int:game_id>', methods=['POST'])
 @login_required
 def delete_game(game_id):
     if current_user.is_authenticated and current_user.username == "admin":
-        game_to_delete = Game.query.get(game_id)
-
-        if game_to_delete is None:
-            flash("Game not found.", 'error')
-        else:
-            db.session.delete(game_to_delete)
+        if soft_delete_game(game_id):
             db.session.commit()
             flash("Game deleted successfully.", 'success')
+        else:
+            flash("Game not found.", 'error')
     return redirect(url_for('admin_panel'))
 
 
@@ -357,9 +1864,15 @@ def delete_game(game_id):
 @login_required
 def manage_teams():
     if current_user.is_authenticated and current_user.username == "admin":
-        # Fetch all teams from the database
-        teams = Team.query.all()
-        return render_template('manage_team.html', teams=teams)
+        # Fetch one page of teams, with their game and members loaded up front
+        query = Team.query.options(selectinload(Team.game), selectinload(Team.members))
+        game_id = request.args.get('game_id', type=int)
+        if game_id:
+            query = query.filter(Team.game_id == game_id)
+
+        teams, next_cursor = keyset_page(query, Team.id, Team.id)
+        games = Game.query.order_by(Game.game_name).all()
+        return render_template('manage_team.html', teams=teams, games=games, game_id=game_id, next_url=next_page_url(next_cursor))
 
     flash("You do not have permission to access the Admin panel.", 'error')
     return redirect(url_for('dashboard'))
@@ -382,6 +1895,7 @@ def edit_team(team_id):
             # Update the team details
             team.name = team_name
             team.game.game_name = game_name
+            bump_game_versions(team.game_id)
             
             # Commit changes to the database
             db.session.commit()
@@ -403,8 +1917,9 @@ def remove_member(team_id, user_id):
         user = User.query.get(user_id)
 
         if team and user:
-            if user in team.members:
-                team.members.remove(user)
+            if remove_team_member(user.id, team.id):
+                bump_game_versions(team.game_id)
+                publish_roster_event('removed', team.id, team.game_id, team.name, user.id, user.fname)
                 db.session.commit()
                 flash("Member removed from the team.", 'success')
             else:
@@ -421,9 +1936,11 @@ def remove_member(team_id, user_id):
 @login_required
 def delete_team(team_id):
     if current_user.is_authenticated and current_user.username == "admin":
-        team = Team.query.get(team_id)
+        team = db.session.execute(db.select(Team.name, Team.game_id).where(Team.id == team_id)).first()
         if team:
-            db.session.delete(team)
+            db.session.execute(db.update(Team).where(Team.id == team_id).values(deleted_at=datetime.utcnow()))
+            bump_game_versions(team.game_id)
+            publish_roster_event('team_deleted', team_id, team.game_id, team.name)
             db.session.commit()
             flash("Team '{}' has been deleted.".format(team.name), 'success')
         else:
@@ -438,31 +1955,38 @@ def delete_team(team_id):
 # Flask Route to View and Edit Profile
 @app.route('/profile', methods=['GET', 'POST'])
 @login_required
+@retry_on_busy
 def profile():
+    user = current_user.record
     if request.method == 'POST':
         # Update profile information in the database based on the form data
-        current_user.fname = request.form['fname']
-        current_user.username = request.form['username']
-        current_user.gender = request.form['gender']
-        current_user.user_class = request.form['user_class']
-        current_user.year = request.form['year']
+        user.fname = request.form['fname']
+        user.username = request.form['username']
+        user.gender = request.form['gender']
+        user.user_class = request.form['user_class']
+        user.year = request.form['year']
+        bump_user_game_versions(user.id)
 
         db.session.commit()
+        invalidate_user(user.id)
         flash("Profile information updated successfully.", 'success')
 
-    return render_template('profile.html', user=current_user)
+    return render_template('profile.html', user=user)
 
 # Flask Route to Change Password
 @app.route('/change_password', methods=['POST'])
 @login_required
+@retry_on_busy
 def change_password():
     current_password = request.form['current_password']
     new_password = request.form['new_password']
 
-    if check_password_hash(current_user.password, current_password):
-        hashed_new_password = generate_password_hash(new_password)
-        current_user.password = hashed_new_password
+    user = current_user.record
+    if verify_password(user.password, current_password):
+        hashed_new_password = hash_password(new_password)
+        user.password = hashed_new_password
         db.session.commit()
+        invalidate_user(user.id)
         flash("Password changed successfully.", 'success')
     else:
         flash("Incorrect current password.", 'error')
@@ -472,44 +1996,99 @@ def change_password():
 # Flask Route to Update Contact Details
 @app.route('/update_contact', methods=['POST'])
 @login_required
+@retry_on_busy
 def update_contact():
     new_email = request.form['new_email']
     new_mobile_number = request.form['new_mobile_number']
 
     # Update contact details in the database
-    current_user.email = new_email
-    current_user.mobile_number = new_mobile_number
+    user = current_user.record
+    user.email = new_email
+    user.mobile_number = new_mobile_number
     db.session.commit()
+    invalidate_user(user.id)
 
     flash("Contact details updated successfully.", 'success')
     return redirect(url_for('profile'))
 
+# Helper function building the joined user -> team -> game report query, one row per membership
+# (users without a team get a single row with empty team columns), ordered so rows of a user are adjacent
+def user_teams_query(username_prefix=''):
+    query = (
+        db.select(
+            User.id, User.username, User.fname, User.email, User.membertype, User.mobile_number,
+            User.gender, User.user_class, User.year,
+            Team.name.label('team_name'), Game.game_name,
+        )
+        .outerjoin(user_team, user_team.c.user_id == User.id)
+        .outerjoin(Team, Team.id == user_team.c.team_id)
+        .outerjoin(Game, Game.id == Team.game_id)
+        .order_by(User.id, user_team.c.team_id)
+    )
+    if username_prefix:
+        query = query.where(prefix_filter(User.username, username_prefix))
+    return query
+
+# Helper function folding the adjacent rows of each user into one entry, without holding more than one user
+def group_user_teams(rows):
+    for _, user_rows in itertools.groupby(rows, key=lambda row: row.id):
+        user_rows = list(user_rows)
+        yield {
+            'user': user_rows[0],
+            'joined_teams': [
+                {'game_name': row.game_name, 'team_name': row.team_name}
+                for row in user_rows if row.team_name is not None
+            ],
+        }
+
 # Admin Panel - User Teams
 @app.route('/admin/user_teams')
 @login_required
 def user_teams():
     if current_user.is_authenticated and current_user.username == "admin":
-        users = User.query.all()
+        username_prefix = request.args.get('username', '').strip()
+        page_query = db.session.query(User.id)
+        if username_prefix:
+            page_query = page_query.filter(prefix_filter(User.username, username_prefix))
+        page, next_cursor = keyset_page(page_query, User.id, User.id)
+
+        # One joined query for the whole page, streamed into the template as it is read
+        query = user_teams_query().where(User.id.in_([row.id for row in page]))
+        rows = db.session.execute(query.execution_options(yield_per=app.config['PAGE_SIZE']))
+        return Response(stream_template(
+            'user_teams.html',
+            user_teams_info=group_user_teams(rows),
+            next_url=next_page_url(next_cursor),
+            csv_url=url_for('user_teams_csv', username=username_prefix or None),
+        ))
 
-        user_teams_info = []
-        for user in users:
-            user_info = {
-                'user': user,
-                'joined_teams': [],
-            }
-            for team in user.teams:
-                user_info['joined_teams'].append({
-                    'game_name': team.game.game_name,
-                    'team_name': team.name,
-                  
-                })
-            user_teams_info.append(user_info)
+    flash("You do not have permission to access the Admin panel.", 'error')
+    return redirect(url_for('dashboard'))
 
-        return render_template('user_teams.html', user_teams_info=user_teams_info)
+# Admin Panel - User Teams as CSV, the full report streamed row by row
+@app.route('/admin/user_teams.csv')
+@login_required
+def user_teams_csv():
+    if current_user.is_authenticated and current_user.username == "admin":
+        query = user_teams_query(request.args.get('username', '').strip())
+
+        def generate():
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            writer.writerow(['user_id', 'username', 'fname', 'email', 'membertype', 'mobile_number',
+                             'gender', 'user_class', 'year', 'team_name', 'game_name'])
+            for row in db.session.execute(query.execution_options(yield_per=1000)):
+                writer.writerow(row)
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+
+        headers = {'Content-Disposition': 'attachment; filename=user_teams.csv'}
+        return Response(stream_with_context(generate()), mimetype='text/csv', headers=headers)
 
     flash("You do not have permission to access the Admin panel.", 'error')
     return redirect(url_for('dashboard'))
-  
+
 @app.route('/admin/change_user_team/<int:user_id>', methods=['POST'])
 @login_required
 def admin_change_user_team(user_id):
@@ -527,7 +2106,30 @@ def admin_change_user_team(user_id):
             flash("Team not found.", 'error')
             return redirect(url_for('user_teams'))  # Redirect to user teams page
         
-        user.team = new_team
+        already_member = db.session.execute(
+            db.select(user_team.c.team_id).where(user_team.c.user_id == user.id, user_team.c.team_id == new_team.id)
+        ).first() is not None
+        if already_member:
+            flash("{} is already in {}.".format(user.username, new_team.name), 'info')
+            return redirect(url_for('user_teams'))  # Redirect to user teams page
+        
+        # Move the user out of their other teams for the same game and into the new one (admins may exceed
+        # team_size); teams they play in for other games are left alone
+        old_teams = db.session.execute(
+            db.select(Team.id, Team.name, Team.game_id)
+            .join(user_team, user_team.c.team_id == Team.id)
+            .where(user_team.c.user_id == user.id, Team.game_id == new_team.game_id, Team.id != new_team.id)
+        ).all()
+        for old_team in old_teams:
+            remove_team_member(user.id, old_team.id)
+            publish_roster_event('removed', old_team.id, old_team.game_id, old_team.name, user.id, user.fname)
+        if add_team_member(user.id, new_team.id, enforce_capacity=False) != 'joined':
+            # Added by a concurrent request since the check above
+            db.session.rollback()
+            flash("{} is already in {}.".format(user.username, new_team.name), 'info')
+            return redirect(url_for('user_teams'))  # Redirect to user teams page
+        publish_roster_event('joined', new_team.id, new_team.game_id, new_team.name, user.id, user.fname)
+        bump_game_versions(new_team.game_id)
         db.session.commit()
         
         flash("{}'s team has been updated.".format(user.username), 'success')
@@ -537,7 +2139,744 @@ def admin_change_user_team(user_id):
     return redirect(url_for('dashboard'))
 
 
+# Admin Panel - User cache hit/miss metrics
+@app.route('/admin/user_cache_stats')
+@login_required
+def user_cache_stats():
+    if current_user.is_authenticated and current_user.username == "admin":
+        return jsonify(user_cache.stats())
+
+    flash("You do not have permission to access the Admin panel.", 'error')
+    return redirect(url_for('dashboard'))
+
+# Bulk import/export: columns accepted for each kind of row, and the integer columns among them
+BULK_KINDS = {
+    'users': (User.__table__, ('fname', 'username', 'membertype', 'email', 'password'), ('mobile_number', 'gender', 'user_class', 'year')),
+    'games': (Game.__table__, ('game_image', 'game_name', 'game_details', 'team_size'), ()),
+    'teams': (Team.__table__, ('name', 'game_id'), ()),
+    'members': (user_team, ('user_id', 'team_id'), ()),
+}
+BULK_INT_COLUMNS = ('team_size', 'game_id', 'user_id', 'team_id')
+
+# Helper function to stream rows from a CSV or JSONL text stream, one line at a time. CSV rows come
+# as dicts; JSONL lines come unparsed so a bad line is reported by clean_bulk_row like any bad row.
+def read_bulk_rows(stream, fmt):
+    if fmt == 'jsonl':
+        for line in stream:
+            line = line.strip()
+            if line:
+                yield line
+    else:
+        for row in csv.DictReader(stream):
+            yield row
+
+# Helper function to check and convert one row; raises ValueError with a readable message
+def clean_bulk_row(kind, row):
+    table, required, optional = BULK_KINDS[kind]
+    if isinstance(row, str):
+        try:
+            row = json.loads(row)
+        except ValueError as error:
+            raise ValueError("invalid JSON: {}".format(error))
+        if not isinstance(row, dict):
+            raise ValueError("expected a JSON object")
+    values = {}
+    for column in required + optional:
+        value = row.get(column)
+        if value in (None, '') and column in required:
+            raise ValueError("missing '{}'".format(column))
+        if value not in (None, ''):
+            # JSON may give numbers (e.g. a numeric password) where the table stores text
+            value = int(value) if column in BULK_INT_COLUMNS else str(value)
+        values[column] = value
+    return values
+
+# Insert one batch with a single executemany; on a constraint error, retry row by row to report the bad rows
+def insert_bulk_batch(table, batch, errors):
+    try:
+        with db.session.begin_nested():
+            db.session.execute(table.insert(), [values for _, values in batch])
+        return len(batch)
+    except IntegrityError:
+        inserted = 0
+        for line_no, values in batch:
+            try:
+                with db.session.begin_nested():
+                    db.session.execute(table.insert(), [values])
+                inserted += 1
+            except IntegrityError as error:
+                errors.append({'row': line_no, 'error': str(error.orig)})
+        return inserted
+
+# Import rows of one kind in batches; bad rows are reported and skipped, the rest are committed
+def import_bulk_rows(kind, rows):
+    table = BULK_KINDS[kind][0]
+    batch_size = app.config['BULK_IMPORT_BATCH_SIZE']
+    report = {'kind': kind, 'inserted': 0, 'errors': []}
+
+    def flush(batch):
+        if kind == 'users':
+            hashes = hash_passwords([values['password'] for _, values in batch], app.config['BULK_IMPORT_HASH_METHOD'])
+            for (_, values), password_hash in zip(batch, hashes):
+                values['password'] = password_hash
+        report['inserted'] += insert_bulk_batch(table, batch, report['errors'])
+        # Dashboard cards of games that gained teams or members must be re-rendered
+        if kind == 'games':
+            bump_game_versions()
+        elif kind == 'teams':
+            bump_game_versions(*[values['game_id'] for _, values in batch])
+        elif kind == 'members':
+            team_ids = set(values['team_id'] for _, values in batch)
+            recount_team_members(team_ids)
+            bump_game_versions(*db.session.execute(db.select(Team.game_id).where(Team.id.in_(team_ids))).scalars())
+        db.session.commit()
+
+    batch = []
+    for line_no, row in enumerate(rows, start=1):
+        try:
+            batch.append((line_no, clean_bulk_row(kind, row)))
+        except (ValueError, TypeError, AttributeError) as error:
+            report['errors'].append({'row': line_no, 'error': str(error)})
+            continue
+        if len(batch) >= batch_size:
+            flush(batch)
+            batch = []
+    if batch:
+        flush(batch)
+    return report
+
+def bulk_format(filename):
+    return 'jsonl' if filename.lower().endswith(('.jsonl', '.json')) else 'csv'
+
+# Uploaded files wait here until their import job runs
+def bulk_upload_path(fmt):
+    directory = os.path.join(app.instance_path, 'imports')
+    os.makedirs(directory, exist_ok=True)
+    return os.path.join(directory, '{}.{}'.format(os.urandom(8).hex(), fmt))
+
+# Imports commit batch by batch, so they are never retried (a retry would insert the first batches again)
+@job_handler('bulk_import')
+def bulk_import_job(kind, path, fmt, filename):
+    try:
+        with open(path, encoding='utf-8-sig', newline='') as stream:
+            report = import_bulk_rows(kind, read_bulk_rows(stream, fmt))
+    finally:
+        os.remove(path)
+    report['filename'] = filename
+    report['error_count'] = len(report['errors'])
+    report['errors'] = report['errors'][:100]
+    return report
+
+# Admin Panel - Bulk import of users, games, teams and team members
+@app.route('/admin/import', methods=['GET', 'POST'])
+@login_required
+def bulk_import():
+    if current_user.is_authenticated and current_user.username == "admin":
+        if request.method == 'POST':
+            kind = request.form['kind']
+            upload = request.files.get('file')
+            if kind not in BULK_KINDS or not upload or not upload.filename:
+                flash("Please choose what to import and a CSV or JSONL file.", 'error')
+            else:
+                fmt = bulk_format(upload.filename)
+                path = bulk_upload_path(fmt)
+                upload.save(path)
+                enqueue('bulk_import', max_attempts=1, kind=kind, path=path, fmt=fmt, filename=upload.filename)
+                db.session.commit()
+                flash("The import of {} from {} has been queued.".format(kind, upload.filename), 'success')
+                return redirect(url_for('bulk_import'))
+
+        imports = Job.query.filter_by(name='bulk_import').order_by(Job.id.desc()).limit(10).all()
+        for job in imports:
+            job.report = json.loads(job.result) if job.result else None
+            job.args = json.loads(job.payload)
+        return render_template('bulk_import.html', kinds=list(BULK_KINDS), imports=imports)
+
+    flash("You do not have permission to access the Admin panel.", 'error')
+    return redirect(url_for('dashboard'))
+
+# Admin Panel - Background jobs, newest first
+@app.route('/admin/jobs')
+@login_required
+def job_list():
+    if current_user.is_authenticated and current_user.username == "admin":
+        counts = db.session.execute(db.select(Job.status, db.func.count()).group_by(Job.status)).all()
+        jobs, next_cursor = keyset_page(Job.query, Job.id, Job.id, descending=True)
+        return render_template('jobs.html', counts=counts, jobs=jobs, next_url=next_page_url(next_cursor))
+
+    flash("You do not have permission to access the Admin panel.", 'error')
+    return redirect(url_for('dashboard'))
+
+# Admin Panel - Streaming export, written row by row instead of built in memory
+@app.route('/admin/export/<kind>.<fmt>')
+@login_required
+def bulk_export(kind, fmt):
+    if current_user.is_authenticated and current_user.username == "admin":
+        if kind not in BULK_KINDS or fmt not in ('csv', 'jsonl'):
+            flash("Unknown export.", 'error')
+            return redirect(url_for('admin_panel'))
+
+        table = BULK_KINDS[kind][0]
+        # Password hashes never leave the database
+        columns = [column for column in table.columns if column.key != 'password']
+
+        def generate():
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            if fmt == 'csv':
+                writer.writerow([column.key for column in columns])
+            result = db.session.execute(db.select(*columns).execution_options(yield_per=1000))
+            for row in result:
+                if fmt == 'csv':
+                    writer.writerow(row)
+                else:
+                    buffer.write(json.dumps(dict(row._mapping), default=str) + '\n')
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+
+        mimetype = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+        headers = {'Content-Disposition': 'attachment; filename={}.{}'.format(kind, fmt)}
+        return Response(stream_with_context(generate()), mimetype=mimetype, headers=headers)
+
+    flash("You do not have permission to access the Admin panel.", 'error')
+    return redirect(url_for('dashboard'))
+
+# CLI - flask --app app import-data users students.csv
+@app.cli.command('import-data')
+@click.argument('kind', type=click.Choice(list(BULK_KINDS)))
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+def import_data_command(kind, path):
+    with open(path, encoding='utf-8-sig', newline='') as stream:
+        report = import_bulk_rows(kind, read_bulk_rows(stream, bulk_format(path)))
+    for error in report['errors']:
+        click.echo("row {}: {}".format(error['row'], error['error']), err=True)
+    click.echo("Imported {} {} ({} rows with errors).".format(report['inserted'], kind, len(report['errors'])))
+
+# Helper function to answer a JSON API request conditionally: the ETag and Last-Modified come from a
+# change version, and an unchanged resource gets a 304 before any data is loaded
+def conditional_json(version_name, etag_suffix, build):
+    version = db.session.execute(
+        db.select(Counter.value, Counter.updated_at).where(Counter.name == version_name)
+    ).first()
+    value, last_modified = version if version else (0, None)
+    etag = '{}-{}{}'.format(version_name.replace(':', '-'), value, etag_suffix)
+
+    if not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+        response = Response(status=304)
+    else:
+        response = jsonify(build())
+    response.set_etag(etag)
+    if last_modified:
+        response.last_modified = last_modified
+    response.cache_control.no_cache = True
+    return response
+
+# JSON API - games with their team counts
+@app.route('/api/games')
+@login_required
+def api_games():
+    def build():
+        team_counts = dict(db.session.execute(
+            db.select(Team.game_id, db.func.count()).group_by(Team.game_id)
+        ).all())
+        rows = db.session.execute(
+            db.select(Game.id, Game.game_name, Game.game_details, Game.game_image, Game.team_size).order_by(Game.id)
+        )
+        return [
+            {'id': row.id, 'name': row.game_name, 'details': row.game_details, 'image': row.game_image,
+             'team_size': row.team_size, 'teams': team_counts.get(row.id, 0)}
+            for row in rows
+        ]
+    return conditional_json('games', '', build)
+
+# JSON API - teams of one game with their member counts
+@app.route('/api/games/<int:game_id>/teams')
+@login_required
+def api_game_teams(game_id):
+    def build():
+        rows = db.session.execute(
+            db.select(Team.id, Team.name, Team.member_count).where(Team.game_id == game_id).order_by(Team.id)
+        )
+        return [{'id': row.id, 'name': row.name, 'members': row.member_count} for row in rows]
+    return conditional_json('game:{}'.format(game_id), '', build)
+
+# JSON API - roster of one team (the same details the dashboard shows)
+@app.route('/api/teams/<int:team_id>/members')
+@login_required
+def api_team_members(team_id):
+    # Deleted and archived teams are left out by the soft-delete filter on Team
+    if db.session.execute(db.select(Team.id).where(Team.id == team_id)).first() is None:
+        return jsonify({'error': 'Team not found.'}), 404
+
+    def build():
+        rows = db.session.execute(
+            db.select(User.id, User.fname, User.membertype, User.gender, User.user_class, User.year)
+            .join(user_team, user_team.c.user_id == User.id)
+            .where(user_team.c.team_id == team_id)
+            .order_by(User.id)
+        )
+        return [dict(row._mapping) for row in rows]
+    return conditional_json('games', '-team-{}'.format(team_id), build)
+
+# Per-worker fan-out of roster events: one thread polls roster_event and wakes every open stream, so
+# the database sees one query per poll interval no matter how many clients are connected
+class RosterFeed:
+    def __init__(self, app):
+        self.app = app
+        self.condition = threading.Condition()
+        self.events = deque(maxlen=app.config['ROSTER_BUFFER_SIZE'])
+        self.last_id = None
+        self.thread = None
+        self.streams = 0
+        self.listeners = []  # Called from the poll thread with each batch of new events
+
+    def start(self):
+        with self.condition:
+            if self.thread is not None:
+                return
+            with self.app.app_context():
+                self.last_id = db.session.execute(db.select(db.func.max(RosterEvent.id))).scalar() or 0
+                db.session.remove()
+            self.thread = threading.Thread(target=self.run, name='roster-feed', daemon=True)
+            self.thread.start()
+
+    def run(self):
+        polls = 0
+        while True:
+            time.sleep(self.app.config['ROSTER_POLL_INTERVAL'])
+            polls += 1
+            try:
+                with self.app.app_context():
+                    self.poll()
+                    # Prune old events now and then; any worker may do it
+                    if polls % 600 == 0:
+                        cutoff = datetime.utcnow() - timedelta(seconds=self.app.config['ROSTER_EVENT_RETENTION'])
+                        db.session.execute(db.delete(RosterEvent).where(RosterEvent.created_at < cutoff))
+                        db.session.commit()
+                    db.session.remove()
+            except OperationalError:
+                # Busy or briefly unavailable database: try again on the next poll
+                continue
+
+    @staticmethod
+    def as_event(row):
+        return {
+            'id': row.id, 'type': row.kind, 'game_id': row.game_id, 'team_id': row.team_id,
+            'team_name': row.team_name, 'user_id': row.user_id, 'user_name': row.user_name,
+        }
+
+    def poll(self):
+        rows = db.session.execute(
+            db.select(RosterEvent).where(RosterEvent.id > self.last_id).order_by(RosterEvent.id).limit(500)
+        ).scalars().all()
+        if not rows:
+            return
+        events = [self.as_event(row) for row in rows]
+        with self.condition:
+            self.events.extend(events)
+            self.last_id = events[-1]['id']
+            self.condition.notify_all()
+        for listener in self.listeners:
+            listener(events)
+
+    # Buffered events after after_id, oldest first. None when after_id is older than the buffer,
+    # so the events in between are only in the table.
+    def newer(self, after_id):
+        if self.last_id <= after_id:
+            return []
+        if not self.events or self.events[0]['id'] > after_id + 1:
+            return None
+        newer = []
+        for item in reversed(self.events):
+            if item['id'] <= after_id:
+                break
+            newer.append(item)
+        return newer[::-1]
+
+    # Block until there are events after after_id (or the timeout passes) and return them;
+    # None means the caller has to backfill from the table
+    def wait(self, after_id, timeout):
+        with self.condition:
+            newer = self.newer(after_id)
+            if newer == []:
+                self.condition.wait(timeout)
+                newer = self.newer(after_id)
+            return newer
+
+    # Count an opened stream; False when the worker already holds ROSTER_MAX_STREAMS of them
+    def open_stream(self):
+        with self.condition:
+            if self.streams >= self.app.config['ROSTER_MAX_STREAMS']:
+                return False
+            self.streams += 1
+            return True
+
+    def close_stream(self):
+        with self.condition:
+            self.streams -= 1
+
+    # Events after after_id read back from roster_event, for streams resuming from before the buffer.
+    # None when they were already pruned.
+    def backfill(self, after_id, limit=500):
+        with self.app.app_context():
+            oldest = db.session.execute(db.select(db.func.min(RosterEvent.id))).scalar()
+            if oldest is None or oldest > after_id + 1:
+                db.session.remove()
+                return None
+            rows = db.session.execute(
+                db.select(RosterEvent).where(RosterEvent.id > after_id, RosterEvent.id <= self.last_id)
+                .order_by(RosterEvent.id).limit(limit)
+            ).scalars().all()
+            events = [self.as_event(row) for row in rows]
+            db.session.remove()
+        return events or None
+
+roster_feed = RosterFeed(app)
+
+# Helper function to format one roster event as a server-sent event
+def format_roster_event(item):
+    return 'id: {}\nevent: {}\ndata: {}\n\n'.format(item['id'], item['type'], json.dumps(item))
+
+# Fan-out server for /events/rosters, run with `flask --app app serve-events` and proxied by the front
+# server next to gunicorn. One asyncio loop holds every stream as an idle socket instead of a thread,
+# and one RosterFeed poll thread feeds them all, so thousands of listeners cost one process.
+class RosterEventServer:
+    def __init__(self, app, feed):
+        self.app = app
+        self.feed = feed
+        self.loop = None
+        self.clients = {}  # writer -> [game_id or None, id of the last event it has seen]
+        self.streams = 0  # Accepted streams, including those still catching up
+
+    async def serve(self, path):
+        self.loop = asyncio.get_running_loop()
+        self.feed.listeners.append(self.publish)
+        self.feed.start()
+        # A socket left behind by a previous run would make the bind fail
+        if os.path.exists(path):
+            os.unlink(path)
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        server = await asyncio.start_unix_server(self.handle, path, backlog=1024)
+        heartbeat = self.loop.create_task(self.heartbeat())
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            heartbeat.cancel()
+            self.feed.listeners.remove(self.publish)
+            if os.path.exists(path):
+                os.unlink(path)
+
+    # Called on the feed's poll thread
+    def publish(self, events):
+        self.loop.call_soon_threadsafe(self.broadcast, events)
+
+    # Each event is formatted once per batch and the bytes are shared by every stream that wants them
+    def broadcast(self, events):
+        formatted = [format_roster_event(item).encode() for item in events]
+        payloads = {}  # game_id filter -> bytes, for streams that have seen none of this batch
+        first_id, last_id = events[0]['id'], events[-1]['id']
+        for writer, state in list(self.clients.items()):
+            game_id, after_id = state
+            if after_id >= last_id:
+                continue
+            state[1] = last_id
+            if after_id < first_id:
+                data = payloads.get(game_id)
+                if data is None:
+                    data = payloads[game_id] = b''.join(
+                        chunk for item, chunk in zip(events, formatted) if game_id is None or item['game_id'] == game_id)
+            else:
+                data = b''.join(chunk for item, chunk in zip(events, formatted)
+                                if item['id'] > after_id and (game_id is None or item['game_id'] == game_id))
+            if data:
+                self.send(writer, data)
+
+    # Write without waiting; a client that stops reading is dropped instead of buffering for it forever
+    def send(self, writer, data):
+        if writer.is_closing():
+            return
+        writer.write(data)
+        if writer.transport.get_write_buffer_size() > 1024 * 1024:
+            writer.close()
+
+    async def heartbeat(self):
+        while True:
+            await asyncio.sleep(self.app.config['ROSTER_HEARTBEAT'])
+            for writer in list(self.clients):
+                self.send(writer, b': keep-alive\n\n')
+
+    # Helper function to read the logged-in user id from the Flask session cookie, as Flask-Login would
+    def session_user_id(self, headers):
+        cookies = parse_cookie(headers.get('cookie', ''))
+        value = cookies.get(self.app.config['SESSION_COOKIE_NAME'])
+        serializer = self.app.session_interface.get_signing_serializer(self.app)
+        if not value or serializer is None:
+            return None
+        try:
+            data = serializer.loads(value, max_age=int(self.app.permanent_session_lifetime.total_seconds()))
+        except Exception:
+            # Bad signature, expired or malformed: treated like no session, as Flask does
+            return None
+        user_id = data.get('_user_id')
+        return user_id if isinstance(user_id, str) and user_id.isdigit() else None
+
+    def user_exists(self, user_id):
+        with self.app.app_context():
+            try:
+                return load_user(user_id) is not None
+            finally:
+                db.session.remove()
+
+    async def respond(self, writer, status, text, headers=''):
+        body = text.encode()
+        writer.write('HTTP/1.1 {}\r\nContent-Type: text/plain; charset=utf-8\r\nContent-Length: {}\r\n{}Connection: close\r\n\r\n'.format(
+            status, len(body), headers).encode() + body)
+        try:
+            await writer.drain()
+        except ConnectionError:
+            pass
+        writer.close()
+
+    async def handle(self, reader, writer):
+        try:
+            head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), 10)
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError, ConnectionError):
+            writer.close()
+            return
+        lines = head.decode('latin-1').split('\r\n')
+        parts = lines[0].split(' ')
+        headers = dict((name.strip().lower(), value.strip()) for name, _, value in
+                       (line.partition(':') for line in lines[1:] if line))
+        target = urlsplit(parts[1] if len(parts) == 3 else '')
+        try:
+            if parts[0] != 'GET' or target.path != '/events/rosters':
+                return await self.respond(writer, '404 Not Found', 'Not found.')
+            game_id = parse_qs(target.query).get('game_id', [None])[0]
+            game_id = int(game_id) if game_id else None
+            last_event_id = int(headers['last-event-id']) if headers.get('last-event-id') else None
+        except ValueError:
+            return await self.respond(writer, '400 Bad Request', 'Bad request.')
+        user_id = self.session_user_id(headers)
+        if user_id is None or not await self.loop.run_in_executor(None, self.user_exists, user_id):
+            return await self.respond(writer, '401 Unauthorized', 'Please log in to access this page.')
+        if self.streams >= self.app.config['EVENTS_MAX_STREAMS']:
+            return await self.respond(writer, '503 Service Unavailable',
+                                      'Too many open event streams, please try again in a moment.', 'Retry-After: 5\r\n')
+        self.streams += 1
+        try:
+            writer.write(b'HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nCache-Control: no-cache\r\n'
+                         b'X-Accel-Buffering: no\r\nConnection: close\r\n\r\nretry: 3000\n\n')
+            after_id = self.feed.last_id if last_event_id is None else last_event_id
+            # Catch up from the buffer (or the table) until nothing is left, then join the broadcast.
+            # Joining right after the empty check, with no await in between, means no batch is missed.
+            while True:
+                with self.feed.condition:
+                    events = self.feed.newer(after_id)
+                if events == []:
+                    self.clients[writer] = [game_id, after_id]
+                    break
+                if events is None:
+                    events = await self.loop.run_in_executor(None, self.feed.backfill, after_id)
+                    if events is None:
+                        # The missed events were pruned: skip to the present and tell the client to reload
+                        after_id = self.feed.last_id
+                        writer.write('id: {}\nevent: reset\ndata: {{}}\n\n'.format(after_id).encode())
+                        continue
+                for item in events:
+                    after_id = item['id']
+                    if game_id is None or item['game_id'] == game_id:
+                        writer.write(format_roster_event(item).encode())
+                await writer.drain()
+            # Nothing more is read from the client; this returns when it goes away or is dropped
+            while await reader.read(4096):
+                pass
+        except ConnectionError:
+            pass
+        finally:
+            self.clients.pop(writer, None)
+            self.streams -= 1
+            writer.close()
+
+# CLI - flask --app app serve-events (proxy /events/rosters to the socket, see README)
+@app.cli.command('serve-events')
+@click.option('--socket', 'path', help='Unix socket to listen on (default EVENTS_SOCKET)')
+def serve_events_command(path):
+    path = path or app.config['EVENTS_SOCKET']
+    # Every stream is an open file; lift the soft limit as far as the hard limit allows
+    import resource
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    wanted = app.config['EVENTS_MAX_STREAMS'] + 256
+    if soft != resource.RLIM_INFINITY and soft < wanted:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (wanted if hard == resource.RLIM_INFINITY else min(wanted, hard), hard))
+    click.echo("Serving roster events on {}".format(path))
+    try:
+        asyncio.run(RosterEventServer(app, roster_feed).serve(path))
+    except KeyboardInterrupt:
+        pass
+
+# Server-sent events stream of roster changes; ?game_id= limits it to one game.
+# Production streams are held by `flask --app app serve-events`. This route serves them without it
+# (flask run, tests), but under gthread workers each open stream holds one of the worker's threads,
+# so it is capped at ROSTER_MAX_STREAMS per worker; clients over the cap get a 503 and retry.
+@app.route('/events/rosters')
+@login_required
+def roster_events():
+    roster_feed.start()
+    game_id = request.args.get('game_id', type=int)
+    last_event_id = request.headers.get('Last-Event-ID', type=int)
+    heartbeat = app.config['ROSTER_HEARTBEAT']
+    if not roster_feed.open_stream():
+        return "Too many open event streams, please try again in a moment.", 503, {'Retry-After': '5'}
+
+    def stream():
+        after_id = roster_feed.last_id if last_event_id is None else last_event_id
+        yield 'retry: 3000\n\n'
+        while True:
+            events = roster_feed.wait(after_id, heartbeat)
+            if events is None:
+                events = roster_feed.backfill(after_id)
+                if events is None:
+                    # The missed events were pruned: skip to the present and tell the client to reload
+                    after_id = roster_feed.last_id
+                    yield 'id: {}\nevent: reset\ndata: {{}}\n\n'.format(after_id)
+                    continue
+            if not events:
+                yield ': keep-alive\n\n'
+                continue
+            for item in events:
+                after_id = item['id']
+                if game_id is None or item['game_id'] == game_id:
+                    yield format_roster_event(item)
+
+    headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    response = Response(stream(), mimetype='text/event-stream', headers=headers)
+    # Runs when the server closes the response, including when the client went away before the first chunk
+    response.call_on_close(roster_feed.close_stream)
+    return response
+
+# Prometheus-style metrics from the request instrumentation (INSTRUMENTATION must be on)
+@app.route('/metrics')
+def metrics():
+    if not app.config['INSTRUMENTATION']:
+        return "Instrumentation is disabled.", 404
+    return Response(request_metrics.prometheus(), mimetype='text/plain; version=0.0.4')
+
+# Admin Panel - cProfile output of the slowest sampled endpoints
+@app.route('/admin/profiles')
+@login_required
+def sampled_profiles():
+    if current_user.is_authenticated and current_user.username == "admin":
+        with request_metrics.lock:
+            profiles = sorted(request_metrics.profiles.items(), key=lambda item: item[1][0], reverse=True)
+        text = '\n\n'.join('=== {} ({:.1f} ms)\n{}'.format(endpoint, wall * 1000, output) for endpoint, (wall, output) in profiles)
+        return Response(text or 'No sampled requests yet.', mimetype='text/plain')
+
+    flash("You do not have permission to access the Admin panel.", 'error')
+    return redirect(url_for('dashboard'))
+
+# Full-text search: external-content FTS5 tables over the searchable columns. Triggers on the source
+# tables keep them in sync, so every write path (forms, admin edits, bulk import, deletes) is covered.
+# kind -> (search table, model, indexed columns, column used for prefix search without FTS5)
+SEARCH_INDEXES = {
+    'games': ('game_search', Game, ('game_name', 'game_details'), 'game_name'),
+    'teams': ('team_search', Team, ('name',), 'name'),
+    'users': ('user_search', User, ('fname', 'username', 'email', 'user_class'), 'username'),
+}
+SEARCH_MAX_TERMS = 8
+search_index_state = {}
+
+# Helper function creating the FTS5 tables and their sync triggers, and filling them from existing rows
+def create_search_index():
+    if db.engine.dialect.name != 'sqlite':
+        return
+    with db.engine.begin() as conn:
+        existing = set(conn.execute(db.text("SELECT name FROM sqlite_master WHERE type = 'table'")).scalars())
+        for search_table, model, columns, _ in SEARCH_INDEXES.values():
+            if search_table in existing:
+                continue
+            source = model.__tablename__
+            names = ', '.join(columns)
+            new_values = ', '.join('new.' + column for column in columns)
+            old_values = ', '.join('old.' + column for column in columns)
+            try:
+                conn.execute(db.text(
+                    "CREATE VIRTUAL TABLE {} USING fts5({}, content='{}', content_rowid='id', prefix='2 3')"
+                    .format(search_table, names, source)
+                ))
+            except OperationalError as error:
+                # SQLite built without FTS5: search falls back to prefix matching
+                app.logger.warning("Full-text search disabled: %s", error)
+                return
+            conn.execute(db.text(
+                'CREATE TRIGGER {0}_ai AFTER INSERT ON "{1}" BEGIN '
+                'INSERT INTO {0}(rowid, {2}) VALUES (new.id, {3}); END'.format(search_table, source, names, new_values)
+            ))
+            conn.execute(db.text(
+                'CREATE TRIGGER {0}_ad AFTER DELETE ON "{1}" BEGIN '
+                "INSERT INTO {0}({0}, rowid, {2}) VALUES ('delete', old.id, {3}); END"
+                .format(search_table, source, names, old_values)
+            ))
+            # Only edits of the indexed columns touch the index (not e.g. team.member_count on every join)
+            conn.execute(db.text(
+                'CREATE TRIGGER {0}_au AFTER UPDATE OF {2} ON "{1}" BEGIN '
+                "INSERT INTO {0}({0}, rowid, {2}) VALUES ('delete', old.id, {4}); "
+                'INSERT INTO {0}(rowid, {2}) VALUES (new.id, {3}); END'
+                .format(search_table, source, names, new_values, old_values)
+            ))
+            conn.execute(db.text("INSERT INTO {0}({0}) VALUES ('rebuild')".format(search_table)))
+    search_index_state.clear()
+
+# Helper function telling whether the FTS5 tables exist in the configured database (checked once per process)
+def search_index_ready():
+    if 'ready' not in search_index_state:
+        ready = db.engine.dialect.name == 'sqlite' and db.session.execute(
+            db.text("SELECT 1 FROM sqlite_master WHERE name = 'game_search'")
+        ).first() is not None
+        search_index_state['ready'] = ready
+    return search_index_state['ready']
+
+# Helper function returning one page of search results, best match first, and the cursor of the next page
+def search_page(kind, terms):
+    search_table, model, _, name_column = SEARCH_INDEXES[kind]
+    if search_index_ready():
+        # Every term is quoted (no FTS query syntax from user input) and matched as a prefix
+        match = ' '.join('"{}"*'.format(term) for term in terms)
+        search = db.table(search_table, db.column('rowid', db.Integer))
+        ranked = (
+            db.select(search.c.rowid.label('id'), db.literal_column('bm25({})'.format(search_table), db.Float).label('score'))
+            .where(db.literal_column(search_table).op('MATCH')(match))
+            .subquery()
+        )
+        # bm25() is lower for better matches, so the ascending keyset order is the ranking
+        page, next_cursor = keyset_page(db.session.query(ranked.c.id, ranked.c.score), ranked.c.score, ranked.c.id)
+    else:
+        column = getattr(model, name_column)
+        query = db.session.query(model.id).filter(prefix_filter(column, ' '.join(terms)))
+        page, next_cursor = keyset_page(query, model.id, model.id)
+
+    ids = [row.id for row in page]
+    query = model.query.filter(model.id.in_(ids))
+    if model is Team:
+        query = query.options(selectinload(Team.game))
+    by_id = {row.id: row for row in query}
+    return [by_id[row_id] for row_id in ids if row_id in by_id], next_cursor
+
+# Search games and teams; admins can also search users
+@app.route('/search')
+@login_required
+def search():
+    kinds = [kind for kind in SEARCH_INDEXES if kind != 'users' or current_user.username == "admin"]
+    kind = request.args.get('kind', 'games')
+    if kind not in kinds:
+        kind = 'games'
+    terms = re.findall(r'\w+', request.args.get('q', ''))[:SEARCH_MAX_TERMS]
+    results, next_cursor = search_page(kind, terms) if terms else ([], None)
+    return render_template('search.html', kinds=kinds, kind=kind, results=results, next_url=next_page_url(next_cursor))
+
 @app.route('/donate', methods=['GET', 'POST'])
+@retry_on_busy
 def donate():
     if request.method == 'POST':
         donor_name = request.form['donor_name']
@@ -547,6 +2886,11 @@ def donate():
         if donor_name and donor_type and donation_amount > 0:
             new_donation = Donationsnew(donor_name=donor_name, donor_type=donor_type, amount=donation_amount)
             db.session.add(new_donation)
+            db.session.flush()
+            user_id = current_user.id if current_user.is_authenticated else None
+            # The running totals are hot rows shared by every donation; update them off the request
+            enqueue('record_donation_totals', priority=5, donation_id=new_donation.id, donor_name=donor_name,
+                    donor_type=donor_type, amount=donation_amount, user_id=user_id)
             db.session.commit()
             flash('Thank you for your donation!', 'success')
         else:
@@ -554,12 +2898,29 @@ def donate():
 
     return redirect(url_for('view_donations'))
 
+@job_handler('record_donation_totals')
+def record_donation_totals_job(donor_name, donor_type, amount, user_id=None, donation_id=None):
+    # A donation archived by end_of_season() before this ran no longer counts; that season's totals were reset
+    if donation_id is not None and db.session.get(Donationsnew, donation_id) is None:
+        return None
+    record_donation_totals(donor_name, donor_type, amount, user_id)
+
 @app.route('/view_donations')
 def view_donations():
-    all_donations = Donationsnew.query.order_by(Donationsnew.amount.desc()).all()
-    total_collected = sum(donation.amount for donation in all_donations)
-    
-    return render_template("view_donations.html", donations=all_donations, total_collected=total_collected)
+    query = Donationsnew.query
+    donor_type = request.args.get('donor_type', '').strip()
+    if donor_type:
+        query = query.filter(Donationsnew.donor_type == donor_type)
+    sort_column = Donationsnew.donation_date if request.args.get('sort') == 'date' else Donationsnew.amount
+
+    donations, next_cursor = keyset_page(query, sort_column, Donationsnew.id, descending=True)
+
+    # Statistics come from the running-total tables, not from scanning every donation
+    type_totals = DonationTotal.query.order_by(DonationTotal.total.desc()).all()
+    total_collected = sum(row.total for row in type_totals)
+    leaderboard = DonorTotal.query.order_by(DonorTotal.total.desc()).limit(app.config['LEADERBOARD_SIZE']).all()
+
+    return render_template("view_donations.html", donations=donations, total_collected=total_collected, type_totals=type_totals, leaderboard=leaderboard, next_url=next_page_url(next_cursor))
 
 
 
@@ -574,7 +2935,133 @@ def logout():
     flash('Logged out successfully.', 'success')
     return redirect(url_for('login'))
 
-if __name__ == '__main__':
+# Bring databases created by older versions of the app up to the current schema
+def migrate_db():
+    inspector = db.inspect(db.engine)
+    if 'updated_at' not in [column['name'] for column in inspector.get_columns('counter')]:
+        with db.engine.begin() as conn:
+            conn.execute(db.text("ALTER TABLE counter ADD COLUMN updated_at DATETIME"))
+    game_columns = [column['name'] for column in inspector.get_columns('game')]
+    if 'image_key' not in game_columns:
+        with db.engine.begin() as conn:
+            conn.execute(db.text("ALTER TABLE game ADD COLUMN image_key VARCHAR(64)"))
+    if 'deleted_at' not in game_columns:
+        with db.engine.begin() as conn:
+            conn.execute(db.text("ALTER TABLE game ADD COLUMN deleted_at DATETIME"))
+            # Replaced by the partial ix_game_game_name_live
+            conn.execute(db.text("DROP INDEX IF EXISTS ix_game_game_name"))
+    team_columns = [column['name'] for column in inspector.get_columns('team')]
+    if 'deleted_at' not in team_columns:
+        with db.engine.begin() as conn:
+            conn.execute(db.text("ALTER TABLE team ADD COLUMN deleted_at DATETIME"))
+            conn.execute(db.text("ALTER TABLE team ADD COLUMN season VARCHAR(50)"))
+    if 'member_count' not in team_columns:
+        with db.engine.begin() as conn:
+            conn.execute(db.text("ALTER TABLE team ADD COLUMN member_count INTEGER NOT NULL DEFAULT 0"))
+        recount_team_members(db.session.execute(db.select(Team.id)).scalars().all())
+        db.session.commit()
+    if 'uq_user_team_user_id_team_id' not in [index['name'] for index in inspector.get_indexes('user_team')]:
+        # Drop duplicate memberships so the unique index can be built
+        if db.engine.dialect.name == 'sqlite':
+            with db.engine.begin() as conn:
+                conn.execute(db.text(
+                    "DELETE FROM user_team WHERE rowid NOT IN "
+                    "(SELECT MIN(rowid) FROM user_team GROUP BY user_id, team_id)"
+                ))
+        recount_team_members(db.session.execute(db.select(Team.id)).scalars().all())
+        db.session.commit()
+    # Donation dates used to be written from Python as naive India time (with microseconds); they are
+    # now stored in UTC. Rows written in between by CURRENT_TIMESTAMP have whole seconds and are already
+    # UTC. Shift the old rows once, before the padding below gives every row microseconds.
+    if db.engine.dialect.name == 'sqlite' and db.session.get(Counter, 'migration:donation_date_utc') is None:
+        for table in ('donationsnew', 'donation_archive'):
+            db.session.execute(db.text(
+                "UPDATE {} SET donation_date = datetime(donation_date, '-330 minutes') "
+                "WHERE donation_date LIKE '%.%'".format(table)
+            ))
+        db.session.add(Counter(name='migration:donation_date_utc', value=1))
+        db.session.commit()
+    # Dates written by CURRENT_TIMESTAMP have whole seconds ('... 12:00:00'), which compare as smaller than
+    # the same time bound as a datetime ('... 12:00:00.000000') and broke paging by date. Pad them once.
+    if db.engine.dialect.name == 'sqlite' and db.session.get(Counter, 'migration:donation_date_format') is None:
+        for table in ('donationsnew', 'donation_archive'):
+            db.session.execute(db.text(
+                "UPDATE {} SET donation_date = donation_date || '.000000' "
+                "WHERE donation_date NOT LIKE '%.%'".format(table)
+            ))
+        db.session.add(Counter(name='migration:donation_date_format', value=1))
+        db.session.commit()
+
+# Create missing tables, and missing indexes on tables that already exist
+def init_db():
+    db.create_all()
+    migrate_db()
+    create_search_index()
+    db.session.commit()
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(db.engine, checkfirst=True)
+    # Backfill the running donation totals the first time they are created
+    if DonationTotal.query.first() is None and Donationsnew.query.first() is not None:
+        rebuild_donation_totals()
+
+# CLI - flask --app app init-db
+@app.cli.command('init-db')
+def init_db_command():
+    with app.app_context():
+        init_db()
+    click.echo("Database is up to date.")
+
+# CLI - flask --app app run-jobs: a dedicated job process (set JOB_WORKERS=0 for the web workers to leave
+# all jobs to it)
+@app.cli.command('run-jobs')
+@click.option('--workers', type=int, default=2, show_default=True)
+def run_jobs_command(workers):
+    job_worker.start(workers)
+    click.echo("Running jobs with {} threads.".format(workers))
+    for thread in job_worker.threads:
+        thread.join()
+
+# Per-process state that must not be inherited across fork (gunicorn workers, multiprocessing):
+# pool threads and timers do not exist in the child, and pooled connections belong to the parent
+def reset_after_fork():
+    global hashing_pool, import_hashing_pool, game_card_lock
+    hashing_pool = HashingPool(app.config['PASSWORD_HASH_POOL'], app.config['PASSWORD_HASH_WORKERS'], app.config['PASSWORD_HASH_QUEUE_LIMIT'])
+    import_hashing_pool = HashingPool(app.config['PASSWORD_HASH_POOL'], app.config['BULK_IMPORT_HASH_WORKERS'], 0)
+    if isinstance(visitor_counter, BatchedCounter):
+        visitor_counter.lock = threading.Lock()
+        visitor_counter.pending = {}
+        visitor_counter.timer = None
+    roster_feed.condition = threading.Condition()
+    roster_feed.thread = None
+    roster_feed.streams = 0
+    roster_feed.listeners = []
+    user_cache.lock = threading.Lock()
+    user_generations.lock = threading.Lock()
+    job_worker.lock = threading.Lock()
+    job_worker.threads = []
+    if isinstance(bucket_store, MemoryBucketStore):
+        bucket_store.lock = threading.Lock()
+    else:
+        bucket_store.local = threading.local()
+    request_metrics.lock = threading.Lock()
+    request_metrics.profiler_lock = threading.Lock()
+    game_card_lock = threading.Lock()
     with app.app_context():
-        db.create_all()
-    app.run()
+        db.engine.dispose(close=False)
+
+os.register_at_fork(after_in_child=reset_after_fork)
+
+# Application entry point for gunicorn: gunicorn -c gunicorn.conf.py 'app:create_app()'
+# With preload_app the master runs this once: the schema is created/migrated before any worker
+# forks, and modules and timezone data loaded here are shared copy-on-write by the workers.
+def create_app(init_database=True):
+    if init_database:
+        with app.app_context():
+            init_db()
+            db.session.remove()
+            db.engine.dispose()
+    return app
+
+if __name__ == '__main__':
+    create_app().run()
@@ -0,0 +1,696 @@
+# Benchmark / load-test harness for the routes in app.py
+#
+# Builds a synthetic dataset in a temporary SQLite database, then measures latency percentiles,
+# throughput and SQL queries per request for each route using Flask's test client.
+#
+#   python benchmark.py --size small
+#   python benchmark.py --size medium --workers 4 --output results.json
+#   python benchmark.py --size small --baseline results.json --threshold 1.25
+#   python benchmark.py --size small --routes '' --startup-budget 1.5
+#   python benchmark.py --size small --routes '' --startup-runs 0 --matchmaking 1000,10000,100000
+#   python benchmark.py --size small --routes '' --startup-runs 0 --rate-limit-checks 100000 --rate-limit-budget-us 50
+#   python benchmark.py --size small --routes '' --startup-runs 0 --sse-streams 5000 --sse-events 200
+#   python benchmark.py --size medium --routes '' --startup-runs 0 --fragment-cache 50
+#   python benchmark.py --size small --routes '' --startup-runs 0 --hash-methods scrypt:32768:8:1,pbkdf2:sha256:600000
+#   python benchmark.py --size medium --routes '' --startup-runs 0 --db-profiles basic,production
+#
+# With --baseline, the run exits with status 1 if any route's p95 latency grew by more than
+# --threshold times the baseline (or its queries per request went up). --startup-budget fails
+# the run when a cold worker takes longer than that many seconds to answer its first request.
+# --matchmaking times the batch team assignment for each given number of signed-up players.
+# --rate-limit-checks times the rate limiter per check for each bucket store; --rate-limit-budget-us
+# fails the run when a check costs more than that many microseconds.
+# --sse-streams opens that many /events/rosters streams on the event server (half of them resuming
+# from before the in-memory buffer), publishes --sse-events roster events and times their delivery;
+# the run fails when a stream misses events, sends more keep-alives than its heartbeat allows, or a
+# stream past EVENTS_MAX_STREAMS is let through.
+# --fragment-cache renders the dashboard that many times with the game card cache emptied before
+# every request (cold) and kept (warm), and reports both.
+# --hash-methods measures login throughput for each PASSWORD_HASH_METHOD, with --hash-logins logins
+# sent by --hash-clients concurrent clients through the password hashing pool.
+# --db-profiles runs reader and writer processes side by side against a copy of the database for
+# each DB_PROFILE and reports read and write latency and failed requests under that contention.
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+SIZES = {
+    'small': {'users': 100, 'games': 10, 'teams': 100, 'donations': 100},
+    'medium': {'users': 10000, 'games': 100, 'teams': 2000, 'donations': 5000},
+    'large': {'users': 100000, 'games': 1000, 'teams': 10000, 'donations': 50000},
+}
+PASSWORD = 'bench-password'
+
+# Route name -> (method, URL or function building it, admin login needed)
+ROUTES = {
+    'dashboard': ('GET', '/', False),
+    'login': ('POST', '/login', False),
+    'join_team': ('POST', lambda ctx: '/join_team/{}'.format(random.choice(ctx['open_teams'])), False),
+    'leave_team': ('POST', lambda ctx: '/leave_team/{}'.format(random.choice(ctx['open_teams'])), False),
+    'view_donations': ('GET', '/view_donations', False),
+    'api_games': ('GET', '/api/games', False),
+    'user_teams': ('GET', '/admin/user_teams', True),
+    'manage_teams': ('GET', '/admin/manage_teams', True),
+    'list_users': ('GET', '/users', True),
+    'list_games': ('GET', '/admin/list_games', True),
+}
+
+
+def load_app(database_path):
+    # app.py reads the database URL at import time
+    os.environ['DATABASE_URL'] = 'sqlite:///' + database_path
+    import app as app_module
+    app_module.app.config['TESTING'] = True
+    # Every benchmark client logs in from the same address; the limiter itself is measured separately
+    app_module.app.config['RATE_LIMITS'] = {}
+    return app_module
+
+
+def seed(app_module, sizes):
+    app, db = app_module.app, app_module.db
+    rng = random.Random(42)
+    with app.app_context():
+        app_module.init_db()
+        # One real hash with the configured method, shared by every synthetic user
+        password_hash = app_module.hash_password(PASSWORD)
+        users = [{'fname': 'Admin', 'username': 'admin', 'membertype': 'Faculty', 'email': 'admin@example.com',
+                  'password': password_hash}]
+        for i in range(1, sizes['users']):
+            users.append({'fname': 'User {}'.format(i), 'username': 'user{}'.format(i), 'membertype': 'Student',
+                          'email': 'user{}@example.com'.format(i), 'password': password_hash,
+                          'gender': rng.choice(['Male', 'Female']), 'user_class': rng.choice(['BCA', 'MCA', 'O Level']),
+                          'year': str(rng.randint(1, 3))})
+        db.session.execute(app_module.User.__table__.insert(), users)
+
+        games = [{'game_image': 'https://example.com/game{}.png'.format(i), 'game_name': 'Game {}'.format(i),
+                  'game_details': 'Details of game {}'.format(i), 'team_size': rng.randint(2, 10)}
+                 for i in range(1, sizes['games'] + 1)]
+        db.session.execute(app_module.Game.__table__.insert(), games)
+
+        teams, members = [], []
+        user_ids = list(range(2, sizes['users'] + 1))
+        rng.shuffle(user_ids)
+        for i in range(1, sizes['teams'] + 1):
+            game_id = rng.randint(1, sizes['games'])
+            # Leave one seat free so join/leave benchmarks always have room
+            count = min(len(user_ids), rng.randint(0, games[game_id - 1]['team_size'] - 1))
+            teams.append({'name': 'Team {}'.format(i), 'game_id': game_id, 'member_count': count})
+            for _ in range(count):
+                members.append({'user_id': user_ids.pop(), 'team_id': i})
+        db.session.execute(app_module.Team.__table__.insert(), teams)
+        if members:
+            db.session.execute(app_module.user_team.insert(), members)
+
+        donations = [{'donor_name': 'Donor {}'.format(rng.randint(1, max(1, sizes['donations'] // 3))),
+                      'donor_type': rng.choice(['Student', 'Faculty']), 'amount': float(rng.randint(10, 1000))}
+                     for _ in range(sizes['donations'])]
+        if donations:
+            db.session.execute(app_module.Donationsnew.__table__.insert(), donations)
+        db.session.commit()
+        app_module.rebuild_donation_totals()
+        db.engine.dispose()
+
+
+def logged_in_client(app_module, username):
+    client = app_module.app.test_client()
+    client.post('/login', data={'username': username, 'password': PASSWORD})
+    return client
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def run_route(app_module, name, requests, warmup, worker):
+    from sqlalchemy import event
+    app, db = app_module.app, app_module.db
+    method, url, admin = ROUTES[name]
+    with app.app_context():
+        open_teams = db.session.execute(db.select(app_module.Team.id)).scalars().all()
+        engine = db.engine
+    ctx = {'open_teams': open_teams}
+    client = logged_in_client(app_module, 'admin' if admin else 'user{}'.format(worker + 1))
+
+    queries = [0]
+
+    def count_query(*args):
+        queries[0] += 1
+    event.listen(engine, 'before_cursor_execute', count_query)
+
+    latencies = []
+    measured_from = time.perf_counter()
+    try:
+        for i in range(warmup + requests):
+            target = url(ctx) if callable(url) else url
+            data = {'username': 'user{}'.format(worker + 1), 'password': PASSWORD} if name == 'login' else None
+            if i == warmup:
+                queries[0] = 0
+                measured_from = time.perf_counter()
+            start = time.perf_counter()
+            response = client.open(target, method=method, data=data)
+            response.get_data()
+            if i >= warmup:
+                latencies.append(time.perf_counter() - start)
+            if response.status_code >= 500:
+                raise RuntimeError('{} returned {}'.format(target, response.status_code))
+    finally:
+        event.remove(engine, 'before_cursor_execute', count_query)
+    return latencies, queries[0], time.perf_counter() - measured_from
+
+
+# Import the app in a fresh interpreter and time it up to the end of its first request
+STARTUP_SNIPPET = (
+    "import time; start = time.perf_counter(); import app; "
+    "app.app.test_client().get('/login').get_data(); print(time.perf_counter() - start)"
+)
+
+
+def measure_startup(database_path, runs):
+    env = dict(os.environ, DATABASE_URL='sqlite:///' + database_path)
+    cwd = os.path.dirname(os.path.abspath(__file__))
+    timings = []
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, '-c', STARTUP_SNIPPET], env=env, cwd=cwd,
+                                capture_output=True, text=True, check=True).stdout
+        timings.append(float(output.strip().splitlines()[-1]))
+    result = {'runs': runs, 'p50_s': round(percentile(timings, 0.5), 3), 'max_s': round(max(timings), 3)}
+    print('{:<16} p50 {:>9.3f} s   max {:>9.3f} s'.format('cold startup', result['p50_s'], result['max_s']))
+    return result
+
+
+# Sign up `count` new players for a fresh game and time one matchmaking run over them
+def benchmark_matchmaking(app_module, counts):
+    app, db = app_module.app, app_module.db
+    rng = random.Random(7)
+    results = {}
+    with app.app_context():
+        password_hash = db.session.execute(db.select(app_module.User.password).limit(1)).scalar()
+        for count in counts:
+            game_id = db.session.execute(app_module.Game.__table__.insert().values(
+                game_image='https://example.com/match.png', game_name='Match {}'.format(count),
+                game_details='Matchmaking benchmark', team_size=5)).inserted_primary_key[0]
+            first_id = db.session.execute(db.select(db.func.max(app_module.User.id))).scalar() + 1
+            db.session.execute(app_module.User.__table__.insert(), [
+                {'fname': 'Player {}'.format(i), 'username': 'mm{}_{}'.format(count, i), 'membertype': 'Student',
+                 'email': 'mm{}_{}@example.com'.format(count, i), 'password': password_hash,
+                 'gender': rng.choice(['Male', 'Female']), 'user_class': rng.choice(['BCA', 'MCA', 'O Level']),
+                 'year': str(rng.randint(1, 3))} for i in range(count)])
+            db.session.execute(app_module.GameSignup.__table__.insert(), [
+                {'game_id': game_id, 'user_id': user_id} for user_id in range(first_id, first_id + count)])
+            db.session.commit()
+
+            game = db.session.get(app_module.Game, game_id)
+            start = time.perf_counter()
+            placed, created = app_module.matchmake(game)
+            db.session.commit()
+            elapsed = time.perf_counter() - start
+            results[str(count)] = {'placed': placed, 'teams': created, 'seconds': round(elapsed, 3),
+                                   'players_per_s': round(placed / elapsed)}
+            print('{:<16} {:>8} players  {:>6} teams  {:>7.3f} s  {:>9} players/s'.format(
+                'matchmaking', placed, created, elapsed, results[str(count)]['players_per_s']))
+    return results
+
+
+# Mean cost of one rate limit check: the bucket store alone, and the whole before_request hook
+def benchmark_rate_limit(app_module, directory, checks):
+    app = app_module.app
+    stores = {'memory': app_module.make_bucket_store('memory'),
+              'sqlite': app_module.make_bucket_store(os.path.join(directory, 'ratelimit.db'))}
+    results = {}
+    limits = app.config['RATE_LIMITS']
+    # A limit that is never reached, so every check takes the allowed path and does the full update
+    app.config['RATE_LIMITS'] = {'login': (checks * 2, 60, 'ip')}
+    try:
+        for name, store in stores.items():
+            keys = ['login:10.0.{}.{}'.format(i // 256, i % 256) for i in range(1000)]
+            start = time.perf_counter()
+            for i in range(checks):
+                store.take(keys[i % len(keys)], checks * 2, 1.0)
+            store_us = (time.perf_counter() - start) / checks * 1e6
+
+            app_module.bucket_store = store
+            with app.test_request_context('/login', method='POST', environ_base={'REMOTE_ADDR': '10.1.2.3'}):
+                start = time.perf_counter()
+                for _ in range(checks):
+                    app_module.check_rate_limit()
+                hook_us = (time.perf_counter() - start) / checks * 1e6
+            results[name] = {'store_us': round(store_us, 2), 'hook_us': round(hook_us, 2)}
+            print('{:<16} store {:>7.2f} us/check   before_request hook {:>7.2f} us/check'.format(
+                'rate limit ' + name, store_us, hook_us))
+    finally:
+        app.config['RATE_LIMITS'] = limits
+    return results
+
+
+# Open `streams` roster event streams on the event server (RosterEventServer on a Unix socket, as
+# `flask --app app serve-events` runs it) and time the delivery of `count` new events to all of them.
+# Odd streams resume from Last-Event-ID 0, which is older than the feed's buffer, so they catch up
+# from the table first. Keep-alives are counted to catch streams that spin instead of waiting.
+def benchmark_sse(app_module, streams, count):
+    import asyncio
+    import resource
+    app, db = app_module.app, app_module.db
+    heartbeat = 1
+    app.config['ROSTER_POLL_INTERVAL'] = 0.05
+    app.config['ROSTER_HEARTBEAT'] = heartbeat
+    app.config['EVENTS_MAX_STREAMS'] = streams
+    # Both ends of every stream are open files in this process
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    wanted = streams * 2 + 256
+    if soft != resource.RLIM_INFINITY and soft < wanted:
+        if hard != resource.RLIM_INFINITY and hard < wanted:
+            raise RuntimeError('{} streams need {} open files; the hard limit is {}'.format(streams, wanted, hard))
+        resource.setrlimit(resource.RLIMIT_NOFILE, (wanted, hard))
+    with app.app_context():
+        team = db.session.execute(db.select(app_module.Team).limit(1)).scalar_one()
+        team_id, game_id = team.id, team.game_id
+        # History from before the streams open, which only the resuming streams receive
+        app_module.publish_roster_event('joined', team_id, game_id, user_name='history')
+        db.session.commit()
+    # Log in up front: the password hashing queue turns away a burst of concurrent logins
+    cookies = [logged_in_client(app_module, 'user{}'.format(i + 1)).get_cookie('session').value
+               for i in range(min(streams, 50))]
+    admin_cookie = logged_in_client(app_module, 'admin').get_cookie('session').value
+
+    directory = tempfile.mkdtemp(prefix='events-')
+    path = os.path.join(directory, 'events.sock')
+    server = app_module.RosterEventServer(app, app_module.roster_feed)
+    threading.Thread(target=asyncio.run, args=(server.serve(path),), name='event-server', daemon=True).start()
+    while not os.path.exists(path):
+        time.sleep(0.01)
+    time.sleep(app.config['ROSTER_POLL_INTERVAL'] * 4)
+    with app.app_context():
+        first_id = db.session.execute(db.select(db.func.max(app_module.RosterEvent.id))).scalar()
+
+    opened, publishing = threading.Event(), threading.Event()
+    received, keepalives, errors, rejected = [None] * streams, [0] * streams, [], []
+    published = {}
+
+    async def request(cookie, headers=''):
+        reader, writer = await asyncio.open_unix_connection(path)
+        writer.write('GET /events/rosters HTTP/1.1\r\nHost: localhost\r\nCookie: session={}\r\n{}\r\n'.format(
+            cookie, headers).encode())
+        status = int((await reader.readuntil(b'\r\n\r\n')).split(b' ', 2)[1])
+        return reader, writer, status
+
+    async def open_stream(index):
+        reader, writer, status = await request(cookies[index % len(cookies)], 'Last-Event-ID: 0\r\n' if index % 2 else '')
+        if status != 200:
+            raise RuntimeError('stream {} got HTTP {}'.format(index, status))
+        await reader.readuntil(b'\n\n')  # retry: line
+        return index, reader, writer
+
+    async def read_stream(index, reader, writer):
+        arrivals = {}
+        pending = b''
+        try:
+            while len(arrivals) < count and not (publishing.is_set() and time.perf_counter() - published['start'] > 30):
+                data = await asyncio.wait_for(reader.read(65536), 35)
+                if not data:
+                    raise ConnectionError('stream closed by the server')
+                now = time.perf_counter()
+                messages = (pending + data).split(b'\n\n')
+                pending = messages.pop()
+                for message in messages:
+                    if message.startswith(b':'):
+                        if publishing.is_set():
+                            keepalives[index] += 1
+                    elif message.startswith(b'id: '):
+                        event_id = int(message[4:message.index(b'\n')])
+                        if event_id > first_id:
+                            arrivals[event_id] = now
+        except (asyncio.TimeoutError, ConnectionError) as error:
+            errors.append('stream {}: {!r}'.format(index, error))
+        writer.close()
+        received[index] = arrivals
+
+    async def run_clients():
+        tasks = []
+        try:
+            # In batches, so the connects stay within the server's listen backlog
+            for start in range(0, streams, 200):
+                for index, reader, writer in await asyncio.gather(*[open_stream(i) for i in range(start, min(start + 200, streams))]):
+                    tasks.append(asyncio.ensure_future(read_stream(index, reader, writer)))
+            # Resuming streams join the broadcast once they have caught up
+            while len(server.clients) < streams:
+                await asyncio.sleep(0.05)
+            # Every allowed stream is open, so one more is turned away
+            reader, writer, status = await request(admin_cookie)
+            rejected.append(status == 503)
+            writer.close()
+        except Exception as error:
+            errors.append(repr(error))
+        opened.set()
+        await asyncio.gather(*tasks)
+
+    clients = threading.Thread(target=asyncio.run, args=(run_clients(),), name='event-clients', daemon=True)
+    clients.start()
+    opened.wait(300)
+    if errors or not opened.is_set():
+        raise RuntimeError('event stream failed: {}'.format(errors[0] if errors else 'streams did not open in time'))
+    published['start'] = start = time.perf_counter()
+    publishing.set()
+    with app.app_context():
+        for i in range(count):
+            app_module.publish_roster_event('joined', team_id, game_id, user_name='bench {}'.format(i))
+            db.session.commit()
+            published[first_id + i + 1] = time.perf_counter()
+    clients.join(60)
+    elapsed = time.perf_counter() - start
+    if errors:
+        raise RuntimeError('event stream failed: {}'.format(errors[0]))
+
+    latencies = [arrivals[event_id] - published[event_id]
+                 for arrivals in received if arrivals for event_id in arrivals if event_id in published]
+    result = {
+        'streams': streams, 'events': count, 'seconds': round(elapsed, 3),
+        'missed': sum(count - len(arrivals or {}) for arrivals in received), 'over_cap_rejected': all(rejected) and bool(rejected),
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 3) if latencies else None,
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 3) if latencies else None,
+        'max_keepalives': max(keepalives),
+        'allowed_keepalives': int(elapsed / heartbeat) + 2,
+    }
+    print('{:<16} {:>5} streams  {:>6} events  p50 {} ms  p95 {} ms  {} missed  {} keep-alives max'.format(
+        'sse', streams, count, result['p50_ms'], result['p95_ms'], result['missed'], result['max_keepalives']))
+    return result
+
+
+# Dashboard latency and queries with the game card cache emptied before every request and kept warm
+def benchmark_fragment_cache(app_module, requests):
+    from sqlalchemy import event
+    app, db = app_module.app, app_module.db
+    client = logged_in_client(app_module, 'user1')
+    client.get('/').get_data()
+    with app.app_context():
+        engine = db.engine
+    queries = [0]
+
+    def count_query(*args):
+        queries[0] += 1
+    results = {}
+    event.listen(engine, 'before_cursor_execute', count_query)
+    try:
+        for mode in ('cold', 'warm'):
+            latencies = []
+            queries[0] = 0
+            for _ in range(requests):
+                if mode == 'cold':
+                    app_module.game_card_cache.clear()
+                start = time.perf_counter()
+                client.get('/').get_data()
+                latencies.append(time.perf_counter() - start)
+            results[mode] = {'p50_ms': round(percentile(latencies, 0.50) * 1000, 3),
+                             'p95_ms': round(percentile(latencies, 0.95) * 1000, 3),
+                             'queries_per_request': round(queries[0] / requests, 2)}
+            print('{:<16} p50 {:>9.2f} ms  p95 {:>9.2f} ms  {:>6.2f} queries/req'.format(
+                'dashboard ' + mode, results[mode]['p50_ms'], results[mode]['p95_ms'], results[mode]['queries_per_request']))
+    finally:
+        event.remove(engine, 'before_cursor_execute', count_query)
+    results['speedup'] = round(results['cold']['p50_ms'] / results['warm']['p50_ms'], 2)
+    return results
+
+
+# Login throughput per password hash method: each method gets its own users whose stored hashes use
+# it (so no login upgrades a hash), then `logins` logins are sent from `clients` threads at once
+def benchmark_hash_methods(app_module, methods, logins, clients):
+    from werkzeug.security import generate_password_hash
+    app, db = app_module.app, app_module.db
+    configured = app.config['PASSWORD_HASH_METHOD']
+    results = {}
+    try:
+        for n, method in enumerate(methods):
+            app.config['PASSWORD_HASH_METHOD'] = method
+            usernames = ['hash{}_{}'.format(n, i) for i in range(clients)]
+            with app.app_context():
+                password_hash = generate_password_hash(PASSWORD, method=method)
+                db.session.execute(app_module.User.__table__.insert(), [
+                    {'fname': username, 'username': username, 'membertype': 'Student',
+                     'email': '{}@example.com'.format(username), 'password': password_hash} for username in usernames])
+                db.session.commit()
+
+            latencies, failures = [], []
+
+            def login(username, count):
+                client = app.test_client()
+                for _ in range(count):
+                    start = time.perf_counter()
+                    response = client.post('/login', data={'username': username, 'password': PASSWORD})
+                    latencies.append(time.perf_counter() - start)
+                    if response.status_code != 302 or '/login' in response.headers.get('Location', ''):
+                        failures.append(response.status_code)
+
+            threads = [threading.Thread(target=login, args=(username, logins // clients + (i < logins % clients)))
+                       for i, username in enumerate(usernames)]
+            start = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            elapsed = time.perf_counter() - start
+            results[method] = {'logins': len(latencies), 'failed': len(failures),
+                               'logins_per_s': round(len(latencies) / elapsed, 1),
+                               'p50_ms': round(percentile(latencies, 0.50) * 1000, 3),
+                               'p95_ms': round(percentile(latencies, 0.95) * 1000, 3)}
+            print('{:<28} {:>8.1f} logins/s  p50 {:>9.2f} ms  p95 {:>9.2f} ms  {} failed'.format(
+                method, results[method]['logins_per_s'], results[method]['p50_ms'], results[method]['p95_ms'],
+                results[method]['failed']))
+    finally:
+        app.config['PASSWORD_HASH_METHOD'] = configured
+    return results
+
+
+# One process of the DB_PROFILE contention run: writers join and leave a team, readers load the
+# dashboard and the games API. Failed requests (e.g. "database is locked") are counted, not raised.
+def contention_main(args):
+    database_path, role, requests, worker = args
+    app_module = load_app(database_path)
+    app, db = app_module.app, app_module.db
+    with app.app_context():
+        team_ids = db.session.execute(db.select(app_module.Team.id)).scalars().all()
+    client = logged_in_client(app_module, 'user{}'.format(worker + 1))
+    rng = random.Random(worker)
+    latencies, failures = [], 0
+    measured_from = time.perf_counter()
+    for i in range(requests):
+        if role == 'writer':
+            team_id = rng.choice(team_ids)
+            urls = [('POST', '/join_team/{}'.format(team_id)), ('POST', '/leave_team/{}'.format(team_id))]
+        else:
+            urls = [('GET', '/' if i % 2 else '/api/games')]
+        for method, url in urls:
+            start = time.perf_counter()
+            response = client.open(url, method=method)
+            response.get_data()
+            latencies.append(time.perf_counter() - start)
+            failures += response.status_code >= 500
+    return role, latencies, failures, time.perf_counter() - measured_from
+
+
+def benchmark_db_profiles(database_path, profiles, requests, readers, writers):
+    results = {}
+    directory = os.path.dirname(database_path)
+    configured = os.environ.get('DB_PROFILE')
+    try:
+        for profile in profiles:
+            # A fresh copy per profile; journal_mode is stored in the file, so set it to match the profile
+            copy_path = os.path.join(directory, 'profile-{}.db'.format(profile))
+            with sqlite3.connect(database_path) as source, sqlite3.connect(copy_path) as target:
+                source.backup(target)
+                target.execute('PRAGMA journal_mode = {}'.format('WAL' if profile == 'production' else 'DELETE'))
+            # Spawned processes read DB_PROFILE from the environment when they import app.py
+            os.environ['DB_PROFILE'] = profile
+            jobs = ([(copy_path, 'writer', requests, worker) for worker in range(writers)] +
+                    [(copy_path, 'reader', requests, writers + worker) for worker in range(readers)])
+            with multiprocessing.get_context('spawn').Pool(len(jobs)) as pool:
+                outputs = pool.map(contention_main, jobs)
+            results[profile] = {}
+            for role in ('reader', 'writer'):
+                latencies = [latency for output in outputs if output[0] == role for latency in output[1]]
+                if not latencies:
+                    continue
+                results[profile][role + 's'] = {
+                    'requests': len(latencies),
+                    'failed': sum(output[2] for output in outputs if output[0] == role),
+                    'p50_ms': round(percentile(latencies, 0.50) * 1000, 3),
+                    'p95_ms': round(percentile(latencies, 0.95) * 1000, 3),
+                    'throughput_rps': round(len(latencies) / max(output[3] for output in outputs if output[0] == role), 1),
+                }
+                line = results[profile][role + 's']
+                print('{:<16} {:<8} p50 {:>9.2f} ms  p95 {:>9.2f} ms  {:>8.1f} req/s  {} failed'.format(
+                    'db ' + profile, role + 's', line['p50_ms'], line['p95_ms'], line['throughput_rps'], line['failed']))
+    finally:
+        if configured is None:
+            os.environ.pop('DB_PROFILE', None)
+        else:
+            os.environ['DB_PROFILE'] = configured
+    return results
+
+
+def worker_main(args):
+    # Runs in a freshly spawned process, so it gets its own engine, pools and caches like a gunicorn worker
+    database_path, name, requests, warmup, worker = args
+    return run_route(load_app(database_path), name, requests, warmup, worker)
+
+
+def benchmark(database_path, app_module, routes, requests, warmup, workers):
+    results = {}
+    for name in routes:
+        if workers == 1:
+            outputs = [run_route(app_module, name, requests, warmup, 0)]
+        else:
+            with multiprocessing.get_context('spawn').Pool(workers) as pool:
+                outputs = pool.map(worker_main, [(database_path, name, requests, warmup, worker)
+                                                 for worker in range(workers)])
+        # Workers run side by side, so throughput is measured over the slowest one's measured phase
+        elapsed = max(output[2] for output in outputs)
+        latencies = [latency for output in outputs for latency in output[0]]
+        total_queries = sum(output[1] for output in outputs)
+        results[name] = {
+            'requests': len(latencies),
+            'mean_ms': round(sum(latencies) / len(latencies) * 1000, 3),
+            'p50_ms': round(percentile(latencies, 0.50) * 1000, 3),
+            'p95_ms': round(percentile(latencies, 0.95) * 1000, 3),
+            'p99_ms': round(percentile(latencies, 0.99) * 1000, 3),
+            'throughput_rps': round(len(latencies) / elapsed, 1),
+            'queries_per_request': round(total_queries / len(latencies), 2),
+        }
+        print('{:<16} p50 {:>9.2f} ms  p95 {:>9.2f} ms  p99 {:>9.2f} ms  {:>8.1f} req/s  {:>6.2f} queries/req'.format(
+            name, results[name]['p50_ms'], results[name]['p95_ms'], results[name]['p99_ms'],
+            results[name]['throughput_rps'], results[name]['queries_per_request']))
+    return results
+
+
+def compare(results, startup, baseline, threshold):
+    regressions = []
+    for name, current in results.items():
+        previous = baseline.get('routes', {}).get(name)
+        if previous is None:
+            continue
+        if current['p95_ms'] > previous['p95_ms'] * threshold:
+            regressions.append('{}: p95 {} ms -> {} ms'.format(name, previous['p95_ms'], current['p95_ms']))
+        if current['queries_per_request'] > previous['queries_per_request']:
+            regressions.append('{}: queries/request {} -> {}'.format(
+                name, previous['queries_per_request'], current['queries_per_request']))
+    previous = baseline.get('startup')
+    if previous and startup and startup['p50_s'] > previous['p50_s'] * threshold:
+        regressions.append('startup: p50 {} s -> {} s'.format(previous['p50_s'], startup['p50_s']))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the Game Management System routes.')
+    parser.add_argument('--size', choices=sorted(SIZES), default='small')
+    parser.add_argument('--users', type=int)
+    parser.add_argument('--games', type=int)
+    parser.add_argument('--teams', type=int)
+    parser.add_argument('--donations', type=int)
+    parser.add_argument('--routes', default=','.join(ROUTES), help='comma-separated route names')
+    parser.add_argument('--requests', type=int, default=50, help='measured requests per route and worker')
+    parser.add_argument('--warmup', type=int, default=5)
+    parser.add_argument('--workers', type=int, default=1, help='processes hitting each route at once')
+    parser.add_argument('--output', help='write results as JSON to this file')
+    parser.add_argument('--baseline', help='JSON results of an earlier run to compare against')
+    parser.add_argument('--threshold', type=float, default=1.25, help='allowed p95 growth over the baseline')
+    parser.add_argument('--startup-runs', type=int, default=3, help='cold-start measurements (0 to skip)')
+    parser.add_argument('--startup-budget', type=float, help='maximum seconds to first request for a cold worker')
+    parser.add_argument('--matchmaking', default='', help='comma-separated player counts to time matchmaking for')
+    parser.add_argument('--rate-limit-checks', type=int, default=0, help='rate limit checks to time per bucket store')
+    parser.add_argument('--rate-limit-budget-us', type=float, help='maximum microseconds per rate limit check')
+    parser.add_argument('--sse-streams', type=int, default=0, help='roster event streams to hold open at once')
+    parser.add_argument('--sse-events', type=int, default=100, help='roster events to publish to the open streams')
+    parser.add_argument('--fragment-cache', type=int, default=0, help='dashboard renders to time with a cold and a warm card cache')
+    parser.add_argument('--hash-methods', default='', help='comma-separated PASSWORD_HASH_METHOD values to measure logins/s for')
+    parser.add_argument('--hash-logins', type=int, default=40, help='logins per hash method')
+    parser.add_argument('--hash-clients', type=int, default=4, help='clients logging in at once')
+    parser.add_argument('--db-profiles', default='', help='comma-separated DB_PROFILE names to compare under read/write contention')
+    parser.add_argument('--contention-requests', type=int, default=100, help='requests per reader and writer process')
+    parser.add_argument('--contention-readers', type=int, default=4, help='reader processes in the contention run')
+    parser.add_argument('--contention-writers', type=int, default=4, help='writer processes in the contention run')
+    args = parser.parse_args()
+
+    sizes = dict(SIZES[args.size])
+    for key in sizes:
+        if getattr(args, key) is not None:
+            sizes[key] = getattr(args, key)
+    routes = [name.strip() for name in args.routes.split(',') if name.strip()]
+    unknown = [name for name in routes if name not in ROUTES]
+    if unknown:
+        parser.error('unknown routes: {}'.format(', '.join(unknown)))
+
+    with tempfile.TemporaryDirectory() as directory:
+        database_path = os.path.join(directory, 'benchmark.db')
+        app_module = load_app(database_path)
+        start = time.perf_counter()
+        seed(app_module, sizes)
+        print('Seeded {} in {:.1f} s'.format(sizes, time.perf_counter() - start))
+        startup = measure_startup(database_path, args.startup_runs) if args.startup_runs else None
+        results = benchmark(database_path, app_module, routes, args.requests, args.warmup, args.workers)
+        counts = [int(count) for count in args.matchmaking.split(',') if count.strip()]
+        matchmaking = benchmark_matchmaking(app_module, counts) if counts else None
+        rate_limit = benchmark_rate_limit(app_module, directory, args.rate_limit_checks) if args.rate_limit_checks else None
+        sse = benchmark_sse(app_module, args.sse_streams, args.sse_events) if args.sse_streams else None
+        fragment_cache = benchmark_fragment_cache(app_module, args.fragment_cache) if args.fragment_cache else None
+        methods = [method.strip() for method in args.hash_methods.split(',') if method.strip()]
+        hash_methods = benchmark_hash_methods(app_module, methods, args.hash_logins, args.hash_clients) if methods else None
+        profiles = [profile.strip() for profile in args.db_profiles.split(',') if profile.strip()]
+        unknown = [profile for profile in profiles if profile not in app_module.DB_PROFILES]
+        if unknown:
+            parser.error('unknown DB profiles: {}'.format(', '.join(unknown)))
+        db_profiles = benchmark_db_profiles(database_path, profiles, args.contention_requests,
+                                            args.contention_readers, args.contention_writers) if profiles else None
+
+    report = {
+        'meta': {'sizes': sizes, 'workers': args.workers, 'requests': args.requests,
+                 'python': platform.python_version(), 'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S')},
+        'startup': startup,
+        'routes': results,
+        'matchmaking': matchmaking,
+        'rate_limit': rate_limit,
+        'sse': sse,
+        'fragment_cache': fragment_cache,
+        'hash_methods': hash_methods,
+        'db_profiles': db_profiles,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if args.startup_budget is not None and startup and startup['max_s'] > args.startup_budget:
+        print('Cold startup took {} s, over the {} s budget.'.format(startup['max_s'], args.startup_budget))
+        sys.exit(1)
+
+    if args.rate_limit_budget_us is not None and rate_limit:
+        slowest = max(result['hook_us'] for result in rate_limit.values())
+        if slowest > args.rate_limit_budget_us:
+            print('A rate limit check took {} us, over the {} us budget.'.format(slowest, args.rate_limit_budget_us))
+            sys.exit(1)
+
+    if sse and (sse['missed'] or sse['max_keepalives'] > sse['allowed_keepalives'] or not sse['over_cap_rejected']):
+        print('Event streams missed {} events and sent up to {} keep-alives ({} allowed); stream over the cap {}.'.format(
+            sse['missed'], sse['max_keepalives'], sse['allowed_keepalives'],
+            'rejected' if sse['over_cap_rejected'] else 'accepted'))
+        sys.exit(1)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, startup, json.load(f), args.threshold)
+        if regressions:
+            print('Regressions against {}:'.format(args.baseline))
+            for line in regressions:
+                print('  ' + line)
+            sys.exit(1)
+        print('No regressions against {}.'.format(args.baseline))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,25 @@
+# gunicorn -c gunicorn.conf.py 'app:create_app()'
+import gc
+import os
+
+# Import the app and run schema setup once in the master; workers are forked from it
+preload_app = True
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+# Threaded workers for ordinary requests. Long-lived /events/rosters streams belong on the event
+# server (`flask --app app serve-events`, see README); if they reach gunicorn anyway, each holds a
+# thread and app.py allows only ROSTER_MAX_STREAMS (default 4) per worker, so keep threads above that.
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 8))
+bind = os.environ.get('BIND', '0.0.0.0:' + os.environ.get('PORT', '8000'))
+
+
+def pre_fork(server, worker):
+    # Move everything loaded so far out of the collector's reach, so collections in the
+    # workers do not touch (and copy) the pages shared with the master
+    gc.freeze()
+
+
+def post_worker_init(worker):
+    # Each worker runs background jobs on JOB_WORKERS threads next to its request threads
+    import app
+    app.job_worker.start()
@@ -0,0 +1,84 @@
+import os
+import sys
+import tempfile
+
+import pytest
+from sqlalchemy import event
+
+# app.py reads these when it is imported, so set them first. Spawned test processes inherit them
+# and import this module again, so they must reuse the parent's database instead of making one.
+if 'TEST_DATABASE_DIR' not in os.environ:
+    os.environ['TEST_DATABASE_DIR'] = tempfile.mkdtemp(prefix='game-management-tests-')
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(os.environ['TEST_DATABASE_DIR'], 'test.db')
+os.environ['USER_GENERATIONS_FILE'] = os.path.join(os.environ['TEST_DATABASE_DIR'], 'user_generations')
+os.environ['JOB_WORKERS'] = '0'
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as app_module  # noqa: E402
+
+PASSWORD = 'test-password'
+
+
+@pytest.fixture
+def app():
+    flask_app = app_module.app
+    flask_app.config.update(TESTING=True, RATE_LIMITS={}, PASSWORD_HASH_METHOD='pbkdf2:sha256:1000')
+    with flask_app.app_context():
+        app_module.db.drop_all()
+        app_module.db.create_all()
+        app_module.db.session.remove()
+    # In-process caches would otherwise carry rows from the previous test's database
+    app_module.user_cache.entries.clear()
+    app_module.game_card_cache.clear()
+    yield flask_app
+    with flask_app.app_context():
+        app_module.db.session.remove()
+        app_module.db.engine.dispose()
+
+
+@pytest.fixture
+def make_user(app):
+    def make_user(username, **fields):
+        values = {'fname': username.title(), 'membertype': 'Student', 'email': '{}@example.com'.format(username),
+                  'password': app_module.hash_password(PASSWORD)}
+        values.update(fields)
+        with app.app_context():
+            user = app_module.User(username=username, **values)
+            app_module.db.session.add(user)
+            app_module.db.session.commit()
+            return user.id
+    return make_user
+
+
+@pytest.fixture
+def login(app):
+    def login(username):
+        client = app.test_client()
+        response = client.post('/login', data={'username': username, 'password': PASSWORD})
+        assert response.status_code == 302
+        return client
+    return login
+
+
+class QueryCounter:
+    def __init__(self, engine):
+        self.engine = engine
+        self.count = 0
+
+    def __call__(self, *args):
+        self.count += 1
+
+    def __enter__(self):
+        event.listen(self.engine, 'before_cursor_execute', self)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(self.engine, 'before_cursor_execute', self)
+
+
+@pytest.fixture
+def count_queries(app):
+    def count_queries():
+        with app.app_context():
+            return QueryCounter(app_module.db.engine)
+    return count_queries
@@ -0,0 +1,28 @@
+from conftest import PASSWORD, app_module
+
+db = app_module.db
+
+USERS = 5
+
+
+def stored_hash(app, username):
+    with app.app_context():
+        return db.session.execute(db.select(app_module.User.password).filter_by(username=username)).scalar_one()
+
+
+def test_imported_passwords_are_hashed_cheaply_and_upgraded_on_login(app):
+    app.config['PASSWORD_HASH_METHOD'] = 'pbkdf2:sha256:2000'
+    rows = [{'fname': 'Player', 'username': 'player{}'.format(i), 'membertype': 'Student',
+             'email': 'player{}@example.com'.format(i), 'password': PASSWORD} for i in range(USERS)]
+    with app.app_context():
+        report = app_module.import_bulk_rows('users', rows)
+    assert report == {'kind': 'users', 'inserted': USERS, 'errors': []}
+    # Import hashing never takes a slot from the pool logins queue on
+    assert app_module.import_hashing_pool is not app_module.hashing_pool
+    assert stored_hash(app, 'player0').startswith(app.config['BULK_IMPORT_HASH_METHOD'] + '$')
+
+    response = app.test_client().post('/login', data={'username': 'player0', 'password': PASSWORD})
+
+    assert response.status_code == 302
+    assert stored_hash(app, 'player0').startswith('pbkdf2:sha256:2000$')
+    assert stored_hash(app, 'player1').startswith(app.config['BULK_IMPORT_HASH_METHOD'] + '$')
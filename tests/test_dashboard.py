@@ -0,0 +1,55 @@
+from conftest import app_module
+
+db = app_module.db
+
+
+def seed_games(app, games, teams_per_game, user_ids):
+    with app.app_context():
+        members = [db.session.get(app_module.User, user_id) for user_id in user_ids]
+        for i in range(games):
+            game = app_module.Game(game_image='https://example.com/{}.png'.format(i), game_name='Game {}'.format(i),
+                                   game_details='Details', team_size=len(members) + 1)
+            db.session.add(game)
+            for j in range(teams_per_game):
+                db.session.add(app_module.Team(name='Team {}-{}'.format(i, j), game=game, members=members,
+                                               member_count=len(members)))
+        db.session.commit()
+
+
+def dashboard_queries(app, client, count_queries):
+    # Cold fragment cache, so the cards are built from the database every time
+    app_module.game_card_cache.clear()
+    with count_queries() as counter:
+        response = client.get('/')
+    assert response.status_code == 200
+    return counter.count
+
+
+def test_dashboard_query_count_does_not_grow_with_games_or_teams(app, make_user, login, count_queries):
+    user_ids = [make_user('player{}'.format(i)) for i in range(3)]
+    make_user('viewer')
+    client = login('viewer')
+
+    seed_games(app, 2, 1, user_ids)
+    # The first request also reads one-time state such as the stored visitor total; leave it out
+    dashboard_queries(app, client, count_queries)
+    small = dashboard_queries(app, client, count_queries)
+
+    seed_games(app, 20, 5, user_ids)
+    large = dashboard_queries(app, client, count_queries)
+
+    assert large == small
+
+
+def test_dashboard_shows_every_team_and_member(app, make_user, login):
+    user_ids = [make_user('player{}'.format(i)) for i in range(2)]
+    make_user('viewer')
+    seed_games(app, 3, 2, user_ids)
+
+    html = login('viewer').get('/').get_data(as_text=True)
+
+    for i in range(3):
+        assert 'Game {}'.format(i) in html
+        for j in range(2):
+            assert 'Team {}-{}'.format(i, j) in html
+    assert 'Player0' in html and 'Player1' in html
@@ -0,0 +1,61 @@
+import re
+from datetime import datetime
+
+from conftest import app_module
+
+db = app_module.db
+
+DONATIONS = 7
+PER_PAGE = 3
+
+
+def page_through(client, url):
+    seen = []
+    for _ in range(DONATIONS):
+        html = client.get(url).get_data(as_text=True)
+        seen.extend(re.findall(r'Donor (\d+)<', html))
+        match = re.search(r'href="([^"]*after=[^"]*)"', html)
+        if match is None:
+            return seen
+        url = match.group(1).replace('&amp;', '&')
+    raise AssertionError('pagination did not end, saw {}'.format(seen))
+
+
+def test_paging_by_date_through_same_second_donations(app, make_user, login):
+    make_user('viewer')
+    with app.app_context():
+        same_second = datetime(2024, 1, 1, 12, 0, 0)
+        db.session.add_all([app_module.Donationsnew(donor_name='Donor {}'.format(i), donor_type='Student', amount=10.0,
+                                                    donation_date=same_second) for i in range(DONATIONS)])
+        db.session.commit()
+
+    seen = page_through(login('viewer'), '/view_donations?sort=date&per_page={}'.format(PER_PAGE))
+
+    assert sorted(seen, key=int) == [str(i) for i in range(DONATIONS)]
+
+
+def test_paging_by_date_through_donations_made_by_default(app, make_user, login):
+    make_user('viewer')
+    with app.app_context():
+        for i in range(DONATIONS):
+            db.session.add(app_module.Donationsnew(donor_name='Donor {}'.format(i), donor_type='Student', amount=10.0))
+            db.session.commit()
+
+    seen = page_through(login('viewer'), '/view_donations?sort=date&per_page={}'.format(PER_PAGE))
+
+    assert seen == [str(i) for i in reversed(range(DONATIONS))]
+
+
+def test_whole_second_rows_from_older_databases_are_migrated(app, make_user, login):
+    make_user('viewer')
+    with app.app_context():
+        for i in range(DONATIONS):
+            db.session.execute(db.text(
+                "INSERT INTO donationsnew (donor_name, donor_type, amount, donation_date) "
+                "VALUES (:name, 'Student', 10.0, '2024-01-01 12:00:00')"), {'name': 'Donor {}'.format(i)})
+        db.session.commit()
+        app_module.migrate_db()
+
+    seen = page_through(login('viewer'), '/view_donations?sort=date&per_page={}'.format(PER_PAGE))
+
+    assert sorted(seen, key=int) == [str(i) for i in range(DONATIONS)]
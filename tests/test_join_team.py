@@ -0,0 +1,118 @@
+import threading
+
+from conftest import app_module
+
+db = app_module.db
+
+TEAM_SIZE = 3
+PLAYERS = 12
+
+
+def make_team(app, team_size):
+    with app.app_context():
+        game = app_module.Game(game_image='https://example.com/game.png', game_name='Game', game_details='Details',
+                               team_size=team_size)
+        team = app_module.Team(name='Team', game=game, member_count=0)
+        db.session.add(team)
+        db.session.commit()
+        return team.id
+
+
+def post_at_once(clients, urls):
+    ready = threading.Barrier(len(clients))
+    statuses = []
+
+    def post(client, url):
+        ready.wait()
+        statuses.append(client.post(url).status_code)
+
+    threads = [threading.Thread(target=post, args=(client, url)) for client, url in zip(clients, urls)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(60)
+    assert statuses == [302] * len(clients)
+
+
+def team_counts(app, team_id):
+    with app.app_context():
+        member_count = db.session.get(app_module.Team, team_id).member_count
+        rows = db.session.execute(
+            db.select(db.func.count()).select_from(app_module.user_team).where(app_module.user_team.c.team_id == team_id)
+        ).scalar()
+        return member_count, rows
+
+
+def test_concurrent_joins_never_overfill_a_team(app, make_user, login):
+    team_id = make_team(app, TEAM_SIZE)
+    clients = []
+    for i in range(PLAYERS):
+        make_user('player{}'.format(i))
+        clients.append(login('player{}'.format(i)))
+
+    post_at_once(clients, ['/join_team/{}'.format(team_id)] * PLAYERS)
+
+    assert team_counts(app, team_id) == (TEAM_SIZE, TEAM_SIZE)
+
+
+def test_concurrent_duplicate_joins_add_one_membership(app, make_user, login):
+    team_id = make_team(app, TEAM_SIZE)
+    make_user('player')
+    clients = [login('player') for _ in range(6)]
+
+    post_at_once(clients, ['/join_team/{}'.format(team_id)] * len(clients))
+
+    assert team_counts(app, team_id) == (1, 1)
+
+
+def test_concurrent_joins_and_leaves_keep_the_count_exact(app, make_user, login):
+    team_id = make_team(app, TEAM_SIZE)
+    clients = []
+    for i in range(PLAYERS):
+        make_user('player{}'.format(i))
+        clients.append(login('player{}'.format(i)))
+    post_at_once(clients[:2], ['/join_team/{}'.format(team_id)] * 2)
+
+    # The two members leave while everyone else tries to take a seat
+    urls = ['/leave_team/{}'.format(team_id)] * 2 + ['/join_team/{}'.format(team_id)] * (PLAYERS - 2)
+    post_at_once(clients, urls)
+
+    member_count, rows = team_counts(app, team_id)
+    assert member_count == rows <= TEAM_SIZE
+
+
+def memberships(app, user_id):
+    with app.app_context():
+        return sorted(db.session.execute(
+            db.select(app_module.user_team.c.team_id).where(app_module.user_team.c.user_id == user_id)
+        ).scalars())
+
+
+def test_admin_team_change_only_moves_the_user_within_the_new_teams_game(app, make_user, login):
+    first_team_id = make_team(app, TEAM_SIZE)
+    other_game_team_id = make_team(app, TEAM_SIZE)
+    with app.app_context():
+        game_id = db.session.get(app_module.Team, first_team_id).game_id
+        second_team = app_module.Team(name='Second', game_id=game_id, member_count=0)
+        db.session.add(second_team)
+        db.session.commit()
+        second_team_id = second_team.id
+    make_user('admin')
+    player_id = make_user('player')
+    player = login('player')
+    player.post('/join_team/{}'.format(first_team_id))
+    player.post('/join_team/{}'.format(other_game_team_id))
+    admin = login('admin')
+
+    admin.post('/admin/change_user_team/{}'.format(player_id), data={'new_team_id': second_team_id})
+
+    assert memberships(app, player_id) == sorted([second_team_id, other_game_team_id])
+    assert team_counts(app, first_team_id) == (0, 0)
+    assert team_counts(app, second_team_id) == (1, 1)
+    assert team_counts(app, other_game_team_id) == (1, 1)
+
+    # Moving the user to a team they are already in changes nothing
+    admin.post('/admin/change_user_team/{}'.format(player_id), data={'new_team_id': second_team_id})
+
+    assert memberships(app, player_id) == sorted([second_team_id, other_game_team_id])
+    assert team_counts(app, second_team_id) == (1, 1)
@@ -0,0 +1,68 @@
+import asyncio
+import os
+import threading
+import time
+
+from conftest import app_module
+
+db = app_module.db
+
+
+def start_event_server(app, path):
+    server = app_module.RosterEventServer(app, app_module.RosterFeed(app))
+    threading.Thread(target=asyncio.run, args=(server.serve(path),), daemon=True).start()
+    deadline = time.monotonic() + 10
+    while not os.path.exists(path):
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+    return server
+
+
+async def open_stream(path, cookie=None):
+    reader, writer = await asyncio.open_unix_connection(path)
+    headers = 'Cookie: session={}\r\n'.format(cookie) if cookie else ''
+    writer.write('GET /events/rosters HTTP/1.1\r\nHost: localhost\r\n{}\r\n'.format(headers).encode())
+    status = int((await reader.readuntil(b'\r\n\r\n')).split(b' ', 2)[1])
+    return reader, writer, status
+
+
+def test_event_server_streams_roster_events_to_logged_in_clients(app, make_user, login, tmp_path, monkeypatch):
+    monkeypatch.setitem(app.config, 'ROSTER_POLL_INTERVAL', 0.05)
+    monkeypatch.setitem(app.config, 'EVENTS_MAX_STREAMS', 2)
+    make_user('player')
+    cookie = login('player').get_cookie('session').value
+    with app.app_context():
+        game = app_module.Game(game_image='https://example.com/game.png', game_name='Game', game_details='Details',
+                               team_size=3)
+        team = app_module.Team(name='Team', game=game, member_count=0)
+        db.session.add(team)
+        db.session.commit()
+        team_id, game_id = team.id, game.id
+    path = str(tmp_path / 'events.sock')
+    server = start_event_server(app, path)
+
+    async def scenario():
+        _, _, anonymous = await open_stream(path)
+        streams = [await open_stream(path, cookie) for _ in range(2)]
+        _, _, over_cap = await open_stream(path, cookie)
+        while len(server.clients) < 2:
+            await asyncio.sleep(0.01)
+        with app.app_context():
+            app_module.publish_roster_event('joined', team_id, game_id, 'Team', 1, 'Player')
+            db.session.commit()
+        messages = []
+        for reader, writer, status in streams:
+            assert status == 200
+            assert await reader.readuntil(b'\n\n') == b'retry: 3000\n\n'
+            messages.append((await asyncio.wait_for(reader.readuntil(b'\n\n'), 10)).decode())
+            writer.close()
+        return anonymous, over_cap, messages
+
+    anonymous, over_cap, messages = asyncio.run(scenario())
+
+    assert anonymous == 401
+    assert over_cap == 503
+    for message in messages:
+        assert message.startswith('id: ')
+        assert '\nevent: joined\n' in message
+        assert '"team_id": {}'.format(team_id) in message
@@ -0,0 +1,110 @@
+import multiprocessing
+
+import pytest
+
+from conftest import PASSWORD, app_module
+
+db = app_module.db
+
+PROFILE = {'fname': 'Renamed Player', 'username': 'player', 'gender': 'Female', 'user_class': 'MCA', 'year': '2'}
+
+
+def greeting(client):
+    response = client.get('/')
+    assert response.status_code == 200
+    return response.get_data(as_text=True)
+
+
+# Runs in a spawned process: another gunicorn worker changing the user, which cannot touch this
+# process's cache and is only seen here through the user's shared generation
+def change_in_other_worker(username, action):
+    import app as worker_module
+    with worker_module.app.app_context():
+        user = worker_module.User.query.filter_by(username=username).one()
+        if action == 'rename':
+            user.fname = 'Renamed Elsewhere'
+        else:
+            worker_module.db.session.delete(user)
+        worker_module.db.session.commit()
+        worker_module.invalidate_user(user.id)
+
+
+def run_in_other_worker(username, action):
+    process = multiprocessing.get_context('spawn').Process(target=change_in_other_worker, args=(username, action))
+    process.start()
+    process.join(120)
+    assert process.exitcode == 0
+
+
+def test_profile_edit_is_shown_on_the_next_request(app, make_user, login):
+    make_user('player')
+    client = login('player')
+    assert 'Player' in greeting(client)
+    assert app_module.user_cache.stats()['size'] == 1
+
+    client.post('/profile', data=PROFILE)
+
+    assert 'Renamed Player' in greeting(client)
+
+
+@pytest.mark.parametrize('columns', [('id', 'username', 'fname'), None])
+def test_contact_and_password_changes_are_not_served_stale(app, make_user, login, columns):
+    app.config['USER_CACHE_COLUMNS'] = columns
+    try:
+        make_user('player')
+        client = login('player')
+        greeting(client)
+
+        client.post('/update_contact', data={'new_email': 'new@example.com', 'new_mobile_number': '12345'})
+        assert 'new@example.com' in client.get('/profile').get_data(as_text=True)
+
+        client.post('/change_password', data={'current_password': PASSWORD, 'new_password': 'changed-password'})
+        assert app.test_client().post('/login', data={'username': 'player', 'password': 'changed-password'}).status_code == 302
+    finally:
+        app.config['USER_CACHE_COLUMNS'] = ('id', 'username', 'fname')
+
+
+def test_edit_in_another_worker_is_not_served_stale(app, make_user, login):
+    make_user('player')
+    client = login('player')
+    assert 'Player' in greeting(client)
+
+    run_in_other_worker('player', 'rename')
+
+    assert 'Renamed Elsewhere' in greeting(client)
+
+
+def test_user_deleted_in_another_worker_is_logged_out(app, make_user, login):
+    make_user('player')
+    client = login('player')
+    greeting(client)
+
+    run_in_other_worker('player', 'delete')
+
+    response = client.get('/')
+    assert response.status_code == 302
+    assert '/login' in response.headers['Location']
+
+
+def test_unchanged_user_is_served_from_the_cache(app, make_user, login):
+    make_user('player')
+    client = login('player')
+    greeting(client)
+    hits = app_module.user_cache.stats()['hits']
+
+    greeting(client)
+
+    assert app_module.user_cache.stats()['hits'] == hits + 1
+
+
+def test_cache_hits_run_no_user_queries(app, make_user, login, count_queries):
+    make_user('player')
+    client = login('player')
+    etag = client.get('/api/games').headers['ETag']
+
+    with count_queries() as queries:
+        response = client.get('/api/games', headers={'If-None-Match': etag})
+
+    assert response.status_code == 304
+    # Only the games version is read; the logged-in user comes from the cache
+    assert queries.count == 1
@@ -0,0 +1,41 @@
+import multiprocessing
+
+import pytest
+
+from conftest import app_module
+
+PROCESSES = 4
+INCREMENTS = 200
+
+
+# Runs in a spawned process, like a gunicorn worker with its own engine and counter
+def increment_many(mode, name, times):
+    import app as worker_module
+    worker_module.app.config['VISITOR_COUNTER'] = mode
+    counter = worker_module.make_visitor_counter(worker_module.app)
+    for _ in range(times):
+        counter.increment(name)
+    if mode == 'batched':
+        counter.flush()
+
+
+@pytest.mark.parametrize('mode', ['sqlite', 'batched'])
+def test_no_increments_are_lost_across_processes(app, mode):
+    context = multiprocessing.get_context('spawn')
+    processes = [context.Process(target=increment_many, args=(mode, 'stress', INCREMENTS)) for _ in range(PROCESSES)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join(120)
+        assert process.exitcode == 0
+
+    assert app_module.SQLiteCounter(app).read('stress') == PROCESSES * INCREMENTS
+
+
+def test_batched_counter_shows_pending_increments(app):
+    counter = app_module.BatchedCounter(app, interval=60)
+    assert [counter.increment('batched') for _ in range(3)] == [1, 2, 3]
+    # Nothing is written until the flush
+    assert counter.store.read('batched') == 0
+    counter.flush()
+    assert counter.store.read('batched') == 3